@@ -1,24 +1,57 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import os
 import time
 import json
+import hashlib
 import logging
 from dotenv import load_dotenv
 from data_loader import data_loader
-from chat_handler import chat_handler
-from security import rate_limit, validate_input, filter_response
+from chat_handler import chat_handler, API_NOT_CONFIGURED_MESSAGE
+from security import rate_limit, validate_input, filter_response, streamable_prefix
 from database import db_manager
 from data_protection import DataProtector, DataProtectionError
 from simple_limiter import SimpleDailyLimiter
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    # Fall back to Flask's stdlib json provider
+    orjson = None
+    ORJSON_AVAILABLE = False
+
 # Load environment variables
 load_dotenv()
 
-# Setup logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Setup logging (LOG_LEVEL=DEBUG shows per-tool chat handler detail)
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(), format='%(asctime)s - %(levelname)s - %(message)s')
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON via orjson: request.get_json() and jsonify() both go through this"""
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def _dump_bytes(self, obj):
+        # Compact, unsorted output; numpy scalars from pandas results serialize natively
+        return orjson.dumps(
+            obj,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE,
+            default=self.default
+        )
+    
+    def dumps(self, obj, **kwargs):
+        return self._dump_bytes(obj)[:-1].decode()
+    
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response, skipping the str round trip
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._dump_bytes(obj), mimetype=self.mimetype)
 
 app = Flask(__name__, static_folder=None)  # Disable Flask's default static handling
+if ORJSON_AVAILABLE:
+    app.json = OrjsonProvider(app)
 CORS(app)
 
 # Initialize simple daily limiter - reads from DAILY_MESSAGE_LIMIT env var (default: 25)
@@ -32,6 +65,7 @@ def initialize_data():
     try:
         data_loader.load_all_data()
         chat_handler.initialize_client()
+        chat_handler.refresh_system_prompt()
         print("✅ Application ready!")
     except Exception as e:
         print(f"⚠️ Initialization warning: {e}")
@@ -40,37 +74,102 @@ def initialize_data():
 # Call initialization
 initialize_data()
 
-@app.route('/api/health', methods=['GET'])
-def health_check():
-    """Health check endpoint"""
-    data_loaded = data_loader.csv_data is not None
-    pdfs_loaded = len(data_loader.pdf_content) > 0
-    api_configured = chat_handler.client is not None
+# Streamed answer text is sent at most this often, so token-sized deltas share SSE frames
+STREAM_FLUSH_SECONDS = 0.01
+
+def _reject_question(user_question, query_lower):
+    """Error response for a question that may not be answered, or None"""
+    # Security validation
+    is_valid, validation_message = validate_input(user_question, query_lower)
+    if not is_valid:
+        return jsonify({"error": validation_message}), 400
+
+    # Data protection validation
+    is_allowed, protection_message = DataProtector.validate_query(user_question, query_lower)
+    if not is_allowed:
+        logging.warning(f"⚠️ Data extraction attempt blocked: {user_question[:100]}")
+        return jsonify({
+            "error": protection_message,
+            "suggestion": "Try asking for: 'top 100 Pro dancers' or 'analyze trends by year'"
+        }), 403
+
+    # Fail fast when Claude isn't configured - don't touch the limiter or the database
+    if chat_handler.client is None:
+        return jsonify({"error": API_NOT_CONFIGURED_MESSAGE}), 503
     
-    # Enhanced debugging for 503 issues
+    return None
+
+def _daily_limit_response(limit_check):
+    """429 response once the day's message budget is spent"""
+    logging.warning(f"⛔ Daily limit hit: {limit_check['message']}")
+    return jsonify({
+        "error": "daily_limit_reached",
+        "message": "This is a free community service with a daily message limit to manage costs. Please try again tomorrow!",
+        "modal_message": "This is a free service paid for by personal funds and is therefore limited to a fixed budget per day. The budget has been hit for today. Please try again tomorrow with your questions.",
+        "retry_after": "Tomorrow (limits reset at midnight)",
+        "current_count": limit_check['current_count'],
+        "daily_limit": limit_check['daily_limit']
+    }), 429
+
+def _sse(payload):
+    """One server-sent event carrying a JSON payload"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+# Health body and ETag, rebuilt only when the state they report changes: (state, body, etag)
+_health_cache = (None, b'', '')
+HEALTH_CACHE_CONTROL = "max-age=5"
+
+def _health_payload(state):
+    """Health check body for a (data, pdfs, client, key) state tuple"""
+    csv_data, pdf_count, api_configured, key_exists = state
+    data_loaded = csv_data is not None
+    
+    # Enhanced debugging for 503 issues; the filesystem is only checked when the body is rebuilt
     debug_info = {
-        "anthropic_key_exists": bool(os.getenv('ANTHROPIC_API_KEY')),
+        "anthropic_key_exists": key_exists,
         "simple_limiter_ready": True,
         "working_directory": os.getcwd(),
         "data_directory_exists": os.path.exists('../data') or os.path.exists('data')
     }
     
-    return jsonify({
+    return {
         "status": "healthy",
         "data_loaded": data_loaded,
-        "pdfs_loaded": pdfs_loaded,
-        "pdf_count": len(data_loader.pdf_content),
+        "pdfs_loaded": pdf_count > 0,
+        "pdf_count": pdf_count,
         "api_configured": api_configured,
-        "total_records": len(data_loader.csv_data) if data_loaded else 0,
+        "total_records": len(csv_data) if data_loaded else 0,
         "debug": debug_info,
         "message": "All 7000+ lines of data processing intact! Backend working."
-    })
+    }
+
+@app.route('/api/health', methods=['GET'])
+def health_check():
+    """Health check endpoint"""
+    global _health_cache
+    state = (
+        data_loader.csv_data,
+        len(data_loader.pdf_content),
+        chat_handler.client is not None,
+        bool(os.getenv('ANTHROPIC_API_KEY'))
+    )
+    cached_state, body, etag = _health_cache
+    # Identity check on the frame: a reload swaps in a new object
+    if cached_state is None or cached_state[0] is not state[0] or cached_state[1:] != state[1:]:
+        body = app.json.dumps(_health_payload(state)).encode() + b"\n"
+        etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        _health_cache = (state, body, etag)
+    
+    headers = {"Cache-Control": HEALTH_CACHE_CONTROL, "ETag": f'"{etag}"'}
+    if etag in request.if_none_match:
+        return Response(status=304, headers=headers)
+    return Response(body, mimetype='application/json', headers=headers)
 
 @app.route('/api/ask', methods=['POST'])
 @rate_limit(max_requests=3, window_minutes=1)
 def ask_question():
     """Main chat endpoint"""
-    start_time = time.time()
+    start_time = time.monotonic()
     
     try:
         data = request.get_json()
@@ -81,54 +180,46 @@ def ask_question():
         if not user_question:
             return jsonify({"error": "No question provided"}), 400
         
-        # Security validation
-        is_valid, validation_message = validate_input(user_question)
-        if not is_valid:
-            return jsonify({"error": validation_message}), 400
-
-        # Data protection validation
-        is_allowed, protection_message = DataProtector.validate_query(user_question)
-        if not is_allowed:
-            logging.warning(f"⚠️ Data extraction attempt blocked: {user_question[:100]}")
-            return jsonify({
-                "error": protection_message,
-                "suggestion": "Try asking for: 'top 100 Pro dancers' or 'analyze trends by year'"
-            }), 403
+        # Lowercase once (question is already stripped); validation and the chat handler's caches reuse it
+        query_lower = user_question.lower()
+        
+        rejection = _reject_question(user_question, query_lower)
+        if rejection:
+            return rejection
 
         # Get client info for logging
         ip_address = request.remote_addr
         
-        # 🚨 SIMPLE DAILY LIMIT - 50 messages total per day
-        limit_check = simple_limiter.can_send_message()
-        
-        if not limit_check['allowed']:
-            logging.warning(f"⛔ Daily limit hit: {limit_check['message']}")
-            return jsonify({
-                "error": "daily_limit_reached",
-                "message": "This is a free community service with a daily message limit to manage costs. Please try again tomorrow!",
-                "modal_message": "This is a free service paid for by personal funds and is therefore limited to a fixed budget per day. The budget has been hit for today. Please try again tomorrow with your questions.",
-                "retry_after": "Tomorrow (limits reset at midnight)",
-                "current_count": limit_check['current_count'],
-                "daily_limit": limit_check['daily_limit']
-            }), 429
-        
-        # Log the query attempt
-        logging.info(f"❓ Query from {ip_address}: {user_question[:100]}")
-        logging.info(f"📊 Usage: {limit_check['message']}")
-        
-        # Process with Claude
-        result = chat_handler.process_query(user_question)
-        if isinstance(result, tuple):
-            response_text, tool_calls_used = result
-        else:
-            response_text = result
+        # Repeats of an already-answered question cost no Claude call, so they skip the daily limit
+        cached_answer = chat_handler.get_cached_answer(user_question, query_lower)
+        if cached_answer:
+            logging.info(f"❓ Query from {ip_address} (cached answer): {user_question[:100]}")
+            response_text = cached_answer
             tool_calls_used = None
+        else:
+            # 🚨 SIMPLE DAILY LIMIT - 50 messages total per day
+            limit_check = simple_limiter.can_send_message()
+            
+            if not limit_check['allowed']:
+                return _daily_limit_response(limit_check)
+            
+            # Log the query attempt
+            logging.info(f"❓ Query from {ip_address}: {user_question[:100]}")
+            logging.info(f"📊 Usage: {limit_check['message']}")
+            
+            # Process with Claude
+            result = chat_handler.process_query(user_question, query_lower)
+            if isinstance(result, tuple):
+                response_text, tool_calls_used = result
+            else:
+                response_text = result
+                tool_calls_used = None
         
         # Filter response
         filtered_response = filter_response(response_text)
         
         # Calculate response time
-        response_time_ms = int((time.time() - start_time) * 1000)
+        response_time_ms = int((time.monotonic() - start_time) * 1000)
         
         # Log query to database (no user tracking)
         query_id = db_manager.log_query(
@@ -141,8 +232,9 @@ def ask_question():
             session_id=session_id
         )
         
-        # 📊 Record successful message for simple daily limit
-        simple_limiter.record_message()
+        # 📊 Record successful message for simple daily limit (cached answers are free)
+        if not cached_answer:
+            simple_limiter.record_message()
         
         return jsonify({
             "answer": filtered_response,
@@ -155,18 +247,116 @@ def ask_question():
         logging.error(f"Server error processing query: {str(e)}", exc_info=True)
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
+@app.route('/api/ask-stream', methods=['POST'])
+@rate_limit(max_requests=3, window_minutes=1)
+def ask_question_stream():
+    """Chat endpoint streaming the answer as server-sent events
+
+    Emits {"delta": text} events as Claude generates the answer, then one final event with the
+    filtered answer, query_id and response_time_ms - the same fields /api/ask returns.
+    """
+    start_time = time.monotonic()
+    
+    try:
+        data = request.get_json()
+        user_question = data.get('question', '').strip()
+        session_id = data.get('session_id')
+        
+        if not user_question:
+            return jsonify({"error": "No question provided"}), 400
+        
+        query_lower = user_question.lower()
+        rejection = _reject_question(user_question, query_lower)
+        if rejection:
+            return rejection
+        
+        ip_address = request.remote_addr
+        
+        # Cached answers skip the daily limit, as in /api/ask
+        cached_answer = chat_handler.get_cached_answer(user_question, query_lower)
+        if cached_answer:
+            logging.info(f"❓ Streaming query from {ip_address} (cached answer): {user_question[:100]}")
+        else:
+            limit_check = simple_limiter.can_send_message()
+            if not limit_check['allowed']:
+                return _daily_limit_response(limit_check)
+            logging.info(f"❓ Streaming query from {ip_address}: {user_question[:100]}")
+            logging.info(f"📊 Usage: {limit_check['message']}")
+    
+    except Exception as e:
+        logging.error(f"Server error processing query: {str(e)}", exc_info=True)
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+    
+    def generate():
+        chunks = [cached_answer] if cached_answer else chat_handler.stream_query(user_question, query_lower)
+        response_text = ""
+        sent = 0
+        last_flush = time.monotonic()
+        try:
+            for text in chunks:
+                response_text += text
+                now = time.monotonic()
+                if now - last_flush < STREAM_FLUSH_SECONDS:
+                    continue
+                last_flush = now
+                # Only stream what filter_response is sure to keep; the final event has the rest
+                safe = streamable_prefix(response_text)
+                if len(safe) > sent:
+                    yield _sse({"delta": safe[sent:]})
+                    sent = len(safe)
+            
+            # Whatever was streamed is a prefix of the filtered answer; send the remainder
+            filtered_response = filter_response(response_text)
+            if len(filtered_response) > sent:
+                yield _sse({"delta": filtered_response[sent:]})
+            
+            response_time_ms = int((time.monotonic() - start_time) * 1000)
+            query_id = db_manager.log_query(
+                user_id=None,
+                ip_address=ip_address,
+                question=user_question,
+                response=filtered_response,
+                response_time_ms=response_time_ms,
+                tool_calls_used=None,
+                session_id=session_id
+            )
+            if not cached_answer:
+                simple_limiter.record_message()
+            
+            yield _sse({
+                "answer": filtered_response,
+                "query_id": query_id,
+                "response_time_ms": response_time_ms,
+                "status": "success"
+            })
+        
+        except Exception as e:
+            logging.error(f"Server error streaming query: {str(e)}", exc_info=True)
+            yield _sse({"error": f"Server error: {str(e)}"})
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Suggested questions never change while the app runs, so the JSON body and its ETag are built once
+SUGGESTED_QUESTIONS = [
+    "How many total dancers have danced in CSA in the last 10 years?",
+    "Who has won the most contest overall?",
+    "Who has won the most CSA contest?",
+    "What Judges are on the Top 20 list of number placements judged in the last 10 years?",
+    "How long does it take to progress from Amateur to Pro?",
+    "Has anyone won every division of both NSDC and CSA?"
+]
+_SUGGESTIONS_BODY = json.dumps({"suggestions": SUGGESTED_QUESTIONS}, separators=(",", ":")).encode()
+_SUGGESTIONS_ETAG = hashlib.blake2b(_SUGGESTIONS_BODY, digest_size=16).hexdigest()
+_SUGGESTIONS_HEADERS = {"Cache-Control": "public, max-age=86400", "ETag": f'"{_SUGGESTIONS_ETAG}"'}
+
 @app.route('/api/suggested-questions', methods=['GET'])
 def get_suggested_questions():
     """Get suggested questions for first-time users"""
-    suggestions = [
-        "How many total dancers have danced in CSA in the last 10 years?",
-        "Who has won the most contest overall?",
-        "Who has won the most CSA contest?",
-        "What Judges are on the Top 20 list of number placements judged in the last 10 years?",
-        "How long does it take to progress from Amateur to Pro?",
-        "Has anyone won every division of both NSDC and CSA?"
-    ]
-    return jsonify({"suggestions": suggestions})
+    # A fresh Response per request: after_request hooks (CORS) add headers to it
+    if _SUGGESTIONS_ETAG in request.if_none_match:
+        return Response(status=304, headers=_SUGGESTIONS_HEADERS)
+    return Response(_SUGGESTIONS_BODY, mimetype='application/json', headers=_SUGGESTIONS_HEADERS)
 
 
 
@@ -233,6 +423,8 @@ def submit_feedback():
 
 # Serve React frontend (for production)
 build_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../frontend/build'))
+# Cache lifetime for fingerprinted build assets (one year); index.html keeps Flask's default
+STATIC_ASSET_MAX_AGE = 31536000
 
 # Check build directory on startup
 print(f"🔍 Frontend build directory: {build_dir}")
@@ -349,17 +541,14 @@ def debug_files():
 @app.route('/<path:path>')
 def serve_static_files(path):
     """Serve static files from React build"""
-    print(f"🔍 Static file request: {path}")
-    
     if not os.path.exists(build_dir):
         print(f"❌ Build directory not found: {build_dir}")
         return "Frontend build directory not found. Please check deployment.", 500
     
     full_path = os.path.join(build_dir, path)
-    print(f"🔍 Looking for file: {full_path}")
-    print(f"📁 File exists: {os.path.exists(full_path)}")
     
     if not os.path.exists(full_path):
+        print(f"🔍 Static file not found: {full_path}")
         # Show what files ARE available for debugging
         try:
             if path.startswith('static/'):
@@ -375,7 +564,9 @@ def serve_static_files(path):
             print(f"⚠️ Debug listing error: {e}")
     
     try:
-        return send_from_directory(build_dir, path)
+        # Build assets under static/ have content hashes in their names, so browsers may keep them
+        max_age = STATIC_ASSET_MAX_AGE if path.startswith('static/') else None
+        return send_from_directory(build_dir, path, max_age=max_age)
     except FileNotFoundError as e:
         print(f"❌ FileNotFoundError: {e}")
         # Fallback to index.html for React Router
@@ -17,6 +17,8 @@ except ImportError:
     print("⚠️ Charts unavailable: matplotlib/seaborn not installed")
 
 from io import BytesIO
+from functools import wraps
+from threading import Lock
 import base64
 from pathlib import Path
 import os
@@ -27,6 +29,18 @@ if CHARTS_AVAILABLE:
     plt.rcParams['figure.figsize'] = (10, 6)
     plt.rcParams['font.size'] = 10
 
+# pyplot keeps global figure state, so charts must be drawn one at a time
+# (tool calls from a single model turn run on a thread pool)
+_plot_lock = Lock()
+
+def _serialized(func):
+    """Hold the plot lock for the whole figure build-and-save"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with _plot_lock:
+            return func(*args, **kwargs)
+    return wrapper
+
 class ChartGenerator:
 
     # Chart cache directory
@@ -47,6 +61,7 @@ class ChartGenerator:
         plt.close()
         return f"data:image/png;base64,{image_base64}"
 
+    @_serialized
     def create_line_chart(self, data: list, x_key: str, y_key: str,
                          title: str, x_label: str, y_label: str) -> str:
         """
@@ -71,6 +86,7 @@ class ChartGenerator:
 
         return self._save_chart_base64()
 
+    @_serialized
     def create_bar_chart(self, data: list, label_key: str, value_key: str,
                         title: str, max_bars: int = 20) -> str:
         """
@@ -103,6 +119,7 @@ class ChartGenerator:
 
         return self._save_chart_base64()
 
+    @_serialized
     def create_comparison_chart(self, categories: list, series_data: dict,
                                title: str) -> str:
         """
@@ -130,6 +147,7 @@ class ChartGenerator:
 
         return self._save_chart_base64()
 
+    @_serialized
     def create_trend_chart_with_change(self, data: list, x_key: str,
                                       y_key: str, change_key: str, title: str) -> str:
         """
@@ -1,169 +1,224 @@
 import os
+import re
+import asyncio
+import sys
 import json
 import time
 import random
 import hashlib
-from threading import Lock
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from operator import methodcaller
+import numpy as np
+from threading import Lock, Event
+from concurrent.futures import ThreadPoolExecutor
 from anthropic import Anthropic
-from anthropic import RateLimitError, APITimeoutError, APIConnectionError
+from anthropic import RateLimitError, APITimeoutError, APIConnectionError, InternalServerError
 from data_loader import data_loader
-from tools import TOOLS, execute_query_csa_data, execute_analyze_csa_data
-from query_cache import query_cache  # Use existing cache system
+from tools import TOOLS, execute_query_csa_data, execute_analyze_csa_data, archive_version
+from query_cache import query_cache, normalize_query  # Use existing cache system
 
-# Simple in-memory cache for API responses (fallback)
-_response_cache = {}
-_cache_lock = Lock()
-CACHE_EXPIRY_SECONDS = 300  # 5 minutes
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    # Fall back to stdlib json + convert_to_json_serializable (see to_json_bytes)
+    orjson = None
+    ORJSON_AVAILABLE = False
 
-def convert_to_json_serializable(obj):
-    """Convert pandas types to native Python types for JSON serialization"""
-    if isinstance(obj, dict):
-        return {key: convert_to_json_serializable(value) for key, value in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_to_json_serializable(item) for item in obj]
-    # Handle numpy types without importing numpy (check type name)
-    elif type(obj).__name__ in ('int64', 'int32', 'int_'):
-        return int(obj)
-    elif type(obj).__name__ in ('float64', 'float32', 'float_'):
-        return float(obj)
-    elif type(obj).__name__ == 'ndarray':
-        return obj.tolist()
-    elif hasattr(obj, 'item'):  # numpy scalar
-        return obj.item()
-    return obj
+logger = logging.getLogger(__name__)
 
-class ChatHandler:
+# Simple in-memory LRU cache for API responses (fallback)
+_response_cache = OrderedDict()
+_cache_lock = Lock()
+CACHE_EXPIRY_SECONDS = 300  # 5 minutes
+MAX_CACHE_BYTES = 2 * 1024 * 1024  # Bound by response size, not entry count
+_cache_bytes_used = 0
+
+# In-flight queries by cache key, so concurrent identical questions share one API call
+_inflight = {}
+INFLIGHT_WAIT_SECONDS = 25  # Stay under the gunicorn/Heroku request timeout
+
+# Statistical questions whose answers rarely change get the longer smart-cache TTL
+_LONG_TTL_RE = re.compile(r'who has the most|top dancers|win rate|career statistics', re.IGNORECASE)
+
+# Shared pool for running several tool calls from one model turn in parallel
+_TOOL_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="tool")
+
+# Serialized tool results keyed by (tool name, canonical input, archive CSV (path, mtime)), LRU-evicted
+_tool_result_cache = OrderedDict()
+_tool_cache_lock = Lock()
+MAX_TOOL_CACHE_ENTRIES = 256
+
+# Once tool results in a conversation pass this size, older rounds are cut to a digest
+MAX_TOOL_CONTEXT_CHARS = 40_000
+TOOL_DIGEST_CHARS = 200
+
+# Sample records in the system prompt: columns left out and per-cell length cap
+SAMPLE_SKIPPED_COLUMNS = frozenset({'Archive ID', 'Record ID', 'Couple Name'})
+SAMPLE_CELL_CHARS = 40
+
+# Circuit breaker: stop calling Anthropic for a while after repeated failures
+CB_FAILURE_THRESHOLD = 5
+CB_FAILURE_WINDOW_SECONDS = 10
+CB_OPEN_SECONDS = 30
+
+# Graceful fallback messages returned in place of a model response
+API_NOT_CONFIGURED_MESSAGE = "Error: API not configured. Please check environment variables."
+RATE_LIMITED_MESSAGE = "I'm experiencing high demand right now. Please try your question again in 30 seconds."
+TIMEOUT_MESSAGE = "Connection timeout. Please try again in a moment."
+GENERIC_ERROR_MESSAGE = "I encountered an error. Please rephrase your question."
+
+# User-facing messages for query errors, by exception class name
+_ERROR_MESSAGES = {
+    "BadRequestError": "Invalid request format. Please rephrase your question and try again.",
+    "RateLimitError": "Too many requests. Please wait a moment before asking another question.",
+    "APIConnectionError": "Connection issue with AI service. Please try again in a moment.",
+    "APITimeoutError": "Request timed out. Your question might be too complex. Please try a simpler query.",
+    "AuthenticationError": "AI service authentication issue. Please contact support.",
+    "ImportError": "System configuration issue. Please contact support.",
+    "ModuleNotFoundError": "System configuration issue. Please contact support.",
+}
+
+class _InFlightQuery:
+    """Result slot for a query being computed by another request"""
     def __init__(self):
-        self.client = None
-        self.api_key = None
-        self.initialize_client()
-        
-    def initialize_client(self):
-        """Initialize Anthropic client with simplified configuration for Heroku"""
-        self.api_key = os.getenv('ANTHROPIC_API_KEY')
-        if self.api_key:
-            try:
-                # CRITICAL: Disable SDK retry to use our fast-fail logic (max_retries=0)
-                self.client = Anthropic(api_key=self.api_key, max_retries=0)
-                print("✅ Claude API client initialized with fast-fail retry (max_retries=0)")
-            except Exception as e:
-                print(f"⚠️ Failed to initialize Claude API client: {e}")
-                self.client = None
-        else:
-            print("⚠️ ANTHROPIC_API_KEY not found - API will not work")
-    
-    def create_system_prompt(self):
-        """Create system prompt with data context and mandatory tool usage"""
-        return f"""You are the CSA Shag Dance Archive expert. Your job is to analyze competitive shag dancing results with PERFECT ACCURACY.
-
-# CRITICAL: YOU HAVE ACCESS TO REAL DATA
-
-You have access to a tool called `query_csa_data` that queries the actual CSA competition database with 7,868 contest records.
-
-**🚨 ABSOLUTELY MANDATORY: ZERO ESTIMATION POLICY 🚨**
-
-**For ANY statistical question, you MUST use the query_csa_data tool.**
-
-**NEVER provide specific numbers, counts, percentages, or rankings without a successful tool call.**
-
-❌ **COMPLETELY FORBIDDEN:**
-- Estimating from sample data 
-- Extrapolating from partial results
-- Using training data knowledge for statistics
-- Providing "approximate" or "around X" numbers
-- Giving specific counts without database queries
-- Making up realistic-sounding statistics
-
-✅ **ONLY ALLOWED:**
-- Exact results from query_csa_data tool calls
-- Admitting when the tool can't answer the specific question
-- Directing users to rephrase if query isn't supported
-
-**IF THE TOOL DOESN'T SUPPORT THE EXACT QUERY:**
-Say: "I cannot provide specific numbers for that query. The database tool doesn't support [specific limitation]. Please rephrase your question or I can suggest alternative queries I can run."
-
-NEVER answer statistical questions from memory or training data. ALWAYS query the actual database using the tool.
-
-**🚨 CRITICAL: RULES, BYLAWS, AND REGULATIONS 🚨**
-
-**For ANY question about CSA rules, bylaws, regulations, advancement criteria, or governance:**
-
-❌ **NEVER make up or infer rule information**
-❌ **NEVER create detailed explanations of rules not explicitly provided**  
-❌ **NEVER state specific point values, advancement criteria, or procedures unless you can quote the exact text**
+        self.event = Event()
+        self.result = None
 
-✅ **ONLY quote actual rule text that is explicitly provided in your knowledge base**
-✅ **If you don't have the exact rule text, say: "I don't have access to that specific rule. Please check the official CSA Rules document or contact CSA directly."**
-✅ **For complex rule questions, direct users to official CSA sources**
-
-**Example of WRONG approach:**
-"You need 100 points to advance to Pro division. Points are awarded as follows: 1st place gets X points..."
-
-**Example of CORRECT approach:**  
-"I don't have access to the complete advancement criteria in the CSA Rules. Please check the official CSA Rules and Regulations document or contact CSA directly for accurate advancement requirements."
-
----
-
-# CRITICAL DATA RULES - FOLLOW EXACTLY
-
-## 1. WHAT COUNTS AS A "WIN"
-- A WIN = Placement column value of 1 (first place ONLY)
-- Placement values 2-8 are NOT wins
-- NEVER count total entries as wins
-- NEVER mix up different divisions
-
-## 2. DATA STRUCTURE YOU'RE WORKING WITH
-The CSV has these columns:
-- Archive ID
-- Contest  
-- Organization (CSA or NSDC)
-- Year
-- Host Club
-- **Placement** (1 = Win, 2-8 = other placements)
-- **Division** (Pro, Amateur, Novice, Junior 1, Junior 2, Sr Pro, etc.)
-- Female Name
-- Male Name
-- Couple Name
-- Judge 1-5
-- Record ID
-
-## 3. COMMON DIVISIONS
-- **Pro**: Highest competitive level
-- **Amateur**: Beginner competitors
-- **Novice**: Mid-level competitors
-- **Junior 1 & Junior 2**: Youth divisions
-- **Sr Pro**: Senior professional
-- **Non-Pro**: NSDC non-professional division
-- **Masters**: Masters division
-- **Overall**: NSDC overall placement
-
-## 4. MANDATORY SINGLE-RESPONSE FORMAT
-
-**CRITICAL: For "top dancers" questions, ALWAYS show BOTH male and female dancers unless user explicitly specifies gender.**
-
-For ANY question about wins or rankings, provide your complete answer in ONE response using this exact structure:
-
-### Part 1: Filter Logic
-```
-Filtering for:
-- Division = [specify which division]
-- Placement = 1 (wins only)
-- Organization = [CSA/NSDC/Both]
-- Gender = both (default - shows top 50 male + top 50 female)
-```
-
-### Part 2: Sample Results (3-5 rows)
-Show actual data rows that prove your filtering is correct
-
-### Part 3: Complete Results
-Present the full answer with counts, rankings, or statistics
+def _identity(obj):
+    return obj
 
-### Part 4: Context & Verification
-Note any important distinctions (entries vs wins, multiple divisions, etc.)
+def _convert_dict(obj):
+    return {key: convert_to_json_serializable(value) for key, value in obj.items()}
+
+def _convert_list(obj):
+    return [convert_to_json_serializable(item) for item in obj]
+
+# Exact-type dispatch table: one dict lookup per node instead of a chain of checks.
+# Types not listed are resolved once by _resolve_converter and remembered here.
+_CONVERT_MAP = {
+    str: _identity,
+    int: _identity,
+    float: _identity,
+    bool: _identity,
+    type(None): _identity,
+    dict: _convert_dict,
+    list: _convert_list,
+    np.int64: int,
+    np.int32: int,
+    np.float64: float,
+    np.float32: float,
+    np.ndarray: np.ndarray.tolist,
+}
+
+def _resolve_converter(obj_type):
+    """Pick a converter for a type missing from _CONVERT_MAP and cache it"""
+    if issubclass(obj_type, dict):
+        converter = _convert_dict
+    elif issubclass(obj_type, list):
+        converter = _convert_list
+    elif issubclass(obj_type, np.ndarray):
+        converter = np.ndarray.tolist
+    elif hasattr(obj_type, 'item'):  # numpy scalar
+        converter = methodcaller('item')
+    else:
+        converter = _identity
+    _CONVERT_MAP[obj_type] = converter
+    return converter
 
-**Do NOT split this into multiple messages. Present all four parts together in one complete response.**
+def convert_to_json_serializable(obj):
+    """Convert pandas/numpy types to native Python types for JSON serialization"""
+    converter = _CONVERT_MAP.get(type(obj)) or _resolve_converter(type(obj))
+    return converter(obj)
 
-## 5. COMMON QUERY PATTERNS
+def _orjson_default(obj):
+    """Handle types orjson can't serialize natively (object arrays, Timestamps, odd scalars)"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    if hasattr(obj, 'item'):
+        return obj.item()
+    # Last resort (pd.NA, Decimal, ...): a readable string beats failing the whole tool call
+    return str(obj)
+
+def to_json_bytes(obj):
+    """Serialize straight from pandas/numpy values to JSON bytes"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(
+            obj,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+            default=_orjson_default
+        )
+    # Legacy path: walk the structure into native types first
+    return json.dumps(convert_to_json_serializable(obj), default=str).encode()
+
+def serialize_tool_result(tool_result):
+    """Serialize a tool result to compact JSON for the tool_result block"""
+    return to_json_bytes(tool_result).decode()
+
+@lru_cache(maxsize=4)
+def _sample_context_text(n, version):
+    """Format n sample records for the prompt; version ties the cache to the loaded CSV"""
+    sample_data = data_loader.get_csv_sample(n)
+    if not sample_data:
+        return "\n\nHere are some recent contest records for context:\n[]"
+    # One header row instead of repeating every key per record; IDs and the derived couple name add tokens, not facts
+    columns = [col for col in sample_data[0] if col not in SAMPLE_SKIPPED_COLUMNS]
+    lines = ["| " + " | ".join(columns) + " |", "|" + "---|" * len(columns)]
+    for record in sample_data:
+        # value != value catches NaN; missing object cells come through as None
+        cells = ('' if record[col] is None or record[col] != record[col] else str(record[col])[:SAMPLE_CELL_CHARS]
+                 for col in columns)
+        lines.append("| " + " | ".join(cells) + " |")
+    table = "\n".join(lines)
+    return f"\n\nHere are some recent contest records for context:\n{table}"
+
+def _compact_tool_results(messages):
+    """Shrink tool results from earlier rounds when the conversation grows too large"""
+    tool_turns = [m["content"] for m in messages
+                  if m["role"] == "user" and isinstance(m["content"], list)]
+    total = sum(len(block["content"]) for turn in tool_turns for block in turn)
+    if total <= MAX_TOOL_CONTEXT_CHARS:
+        return
+    
+    # The latest round is what the model is answering from, so it stays intact
+    for turn in tool_turns[:-1]:
+        for block in turn:
+            content = block["content"]
+            if len(content) > TOOL_DIGEST_CHARS and not content.startswith("[earlier tool result"):
+                block["content"] = f"[earlier tool result summarized: {content[:TOOL_DIGEST_CHARS]}]"
+    logger.debug("🗜️ Compacted earlier tool results (%d chars before)", total)
+
+@dataclass(frozen=True)
+class _MockContent:
+    """Text block standing in for Anthropic response content"""
+    text: str
+    type: str = 'text'
+
+@dataclass(frozen=True)
+class _MockResponse:
+    """Stand-in for an Anthropic response carrying a graceful error message"""
+    content: tuple
+    stop_reason: str
+
+# Built once; immutable, so safe to hand out from any thread
+_RATE_LIMITED_RESPONSE = _MockResponse((_MockContent(RATE_LIMITED_MESSAGE),), 'rate_limited')
+_TIMEOUT_RESPONSE = _MockResponse((_MockContent(TIMEOUT_MESSAGE),), 'timeout')
+_ERROR_RESPONSE = _MockResponse((_MockContent(GENERIC_ERROR_MESSAGE),), 'error')
+_FALLBACK_MESSAGES = frozenset({RATE_LIMITED_MESSAGE, TIMEOUT_MESSAGE, GENERIC_ERROR_MESSAGE})
+_FALLBACK_STOP_REASONS = frozenset({'rate_limited', 'timeout', 'error'})
+
+# Streamed answers put a blank line between the text of consecutive model turns
+TURN_SEPARATOR = "\n\n"
+
+# Worked examples kept out of the core system prompt; only the banks whose
+# trigger matches the question are sent (see select_prompt_examples)
+PROMPT_EXAMPLES = {
+    "query_patterns": """## COMMON QUERY PATTERNS
 
 ### "Who has the most [Division] wins?"
 In ONE response, show:
@@ -193,7 +248,7 @@ In ONE response, clarify:
 In ONE response, show:
 ```python
 # Use judge_statistics query type
-query_csa_data(query_type="judge_statistics", filters={{"organization": "Both"}}, limit=100)
+query_csa_data(query_type="judge_statistics", filters={"organization": "Both"}, limit=100)
 # Counts appearances across Judge 1-5 columns
 # Present results with data completeness transparency
 ```
@@ -207,52 +262,41 @@ query_csa_data(query_type="judge_statistics", filters={{"organization": "Both"}}
 
 ### "How many unique dancers are in the database?"
 ```python
-query_csa_data(query_type="unique_counts", filters={{"count_what": "all_dancers", "organization": "Both"}})
+query_csa_data(query_type="unique_counts", filters={"count_what": "all_dancers", "organization": "Both"})
 ```
 
 ### "What's Sam West's win rate?"
 ```python
-query_csa_data(query_type="win_statistics", filters={{"dancer_name": "Sam West", "organization": "Both"}})
+query_csa_data(query_type="win_statistics", filters={"dancer_name": "Sam West", "organization": "Both"})
 ```
 
 ### "Who were Sam West's best partners?"
 ```python
-query_csa_data(query_type="partnership_analysis", filters={{"dancer_name": "Sam West"}})
+query_csa_data(query_type="partnership_analysis", filters={"dancer_name": "Sam West"})
 ```
 
 ### "What's Sam West's career span?"
 ```python
-query_csa_data(query_type="career_statistics", filters={{"dancer_name": "Sam West"}})
+query_csa_data(query_type="career_statistics", filters={"dancer_name": "Sam West"})
 ```
 
 ### "Show contest trends over time"
 ```python
-query_csa_data(query_type="yearly_trends", filters={{"metric": "entries", "organization": "CSA"}})
+query_csa_data(query_type="yearly_trends", filters={"metric": "entries", "organization": "CSA"})
 ```
-
-## 🚨 CRITICAL: SMART DANCER LOOKUP - ALWAYS USE THIS FIRST
-
-**For ANY query about a specific dancer's record, career, or statistics:**
-
-✅ **MANDATORY: Use smart_dancer_lookup query type FIRST**
-❌ **FORBIDDEN: Using dancer_record, dancer_search, or custom_query for dancer names**
-❌ **FORBIDDEN: Trying multiple query types - smart_dancer_lookup handles everything**
-
-**Why this exists:** Prevents multiple API calls. smart_dancer_lookup does exact match, partial match,
-filtering, and complete summary in ONE tool call.
-
-### Smart Dancer Lookup Examples:
+""",
+    "dancer_lookup": """### Smart Dancer Lookup Examples:
 
 **Q: "Show me Brittney Miller's CSA record from 2022-2024"**
 ```python
 query_csa_data(
     query_type="smart_dancer_lookup",
-    filters={{
+    filters={
         "dancer_name": "Brittney Miller",
         "start_year": 2022,
         "end_year": 2024,
         "organization": "CSA"
-    }},
+    },
     limit=100
 )
 ```
@@ -261,7 +305,7 @@ query_csa_data(
 ```python
 query_csa_data(
     query_type="smart_dancer_lookup",
-    filters={{"dancer_name": "Sam West", "organization": "Both"}}
+    filters={"dancer_name": "Sam West", "organization": "Both"}
 )
 ```
 
@@ -269,29 +313,17 @@ query_csa_data(
 ```python
 query_csa_data(
     query_type="smart_dancer_lookup",
-    filters={{"dancer_name": "Joey Sogluizzo", "division": "Pro"}}
+    filters={"dancer_name": "Joey Sogluizzo", "division": "Pro"}
 )
 ```
-
-**What smart_dancer_lookup returns:**
-- Exact or partial name matches (both Male Name and Female Name columns)
-- Total contests, total wins, win rate percentage
-- Career span (first year to last year)
-- Division breakdown (contests and wins per division)
-- Sample recent contests
-- ALL IN ONE RESPONSE - no follow-up calls needed
-
-**NEVER use dancer_record or custom_query when asking about a dancer by name. ALWAYS use smart_dancer_lookup.**
-
-## ANALYTICAL QUERIES - Use analyze_csa_data Tool
-
-**For statistical analysis, trends, and aggregations, use analyze_csa_data (NOT query_csa_data).**
+""",
+    "analysis": """## ANALYSIS EXAMPLES
 
 ### Yearly Active Dancers:
 ```python
 analyze_csa_data(
     analysis_type="yearly_active_dancers",
-    filters={{"organization": "CSA"}}
+    filters={"organization": "CSA"}
 )
 ```
 Returns: Year-by-year table with male/female/total active dancers and year-over-year change
@@ -300,7 +332,7 @@ Returns: Year-by-year table with male/female/total active dancers and year-over-
 ```python
 analyze_csa_data(
     analysis_type="judge_dancer_frequency",
-    filters={{"judge_name": "Vickie Chambers"}},
+    filters={"judge_name": "Vickie Chambers"},
     limit=100
 )
 ```
@@ -310,7 +342,7 @@ Returns: Which dancers this judge saw most often, with win rates when judged
 ```python
 analyze_csa_data(
     analysis_type="judge_panel_combinations",
-    filters={{"min_occurrences": 10}}
+    filters={"min_occurrences": 10}
 )
 ```
 Returns: Which judges most frequently judge together
@@ -319,7 +351,7 @@ Returns: Which judges most frequently judge together
 ```python
 analyze_csa_data(
     analysis_type="judge_dancer_outcomes",
-    filters={{"dancer_name": "Sam West", "min_occurrences": 10}}
+    filters={"dancer_name": "Sam West", "min_occurrences": 10}
 )
 ```
 Returns: Win rates with specific judges present vs overall win rate
@@ -328,7 +360,7 @@ Returns: Win rates with specific judges present vs overall win rate
 ```python
 analyze_csa_data(
     analysis_type="retention_analysis",
-    filters={{"organization": "CSA"}}
+    filters={"organization": "CSA"}
 )
 ```
 Returns: How many Amateur dancers eventually reach Pro
@@ -337,22 +369,12 @@ Returns: How many Amateur dancers eventually reach Pro
 ```python
 analyze_csa_data(
     analysis_type="career_progression_time",
-    filters={{"organization": "Both"}}
+    filters={"organization": "Both"}
 )
 ```
 Returns: Average, fastest, slowest time from Amateur to Pro
-
-**CRITICAL: Use analyze_csa_data for aggregations/statistics. Use query_csa_data for individual records.**
-
-## 🎨 RICH FORMATTING AND VISUALIZATION
-
-**The analyze_csa_data and smart_dancer_lookup tools return enhanced responses with:**
-1. **formatted_table** or **formatted_list** - Pre-formatted markdown ready to display
-2. **chart_base64** - Chart as base64 data URL (when available)
-3. **summary_stats** - Key statistics dictionary
-4. **raw_data** - Underlying data for additional analysis
-
-**How to use these in responses:**
+""",
+    "ranking_example": """## USING FORMATTED TOOL OUTPUT
 
 ### For Tables:
 When you receive formatted_table from the tool, insert it directly into your response:
@@ -360,14 +382,14 @@ When you receive formatted_table from the tool, insert it directly into your res
 **Example:**
 Here's the yearly trend:
 
-{{formatted_table}}
+{formatted_table}
 
 Then add insights below the table.
 
 ### For Ranked Lists:
 When you receive formatted_list, insert it directly:
 
-{{formatted_list}}
+{formatted_list}
 
 Then provide context and analysis.
 
@@ -380,17 +402,8 @@ When chart_base64 is provided:
 ### For Summary Stats:
 Use summary_stats to provide quick insights:
 **Key Findings:**
-- Peak year: {{peak_year}} with {{peak_count}} dancers
-- Average: {{average_dancers_per_year}} dancers per year
-
-**CRITICAL FORMATTING RULES:**
-
-1. **ALWAYS use formatted_list or formatted_table fields** - NEVER create your own lists from raw results
-2. **Copy formatted_list EXACTLY** - Do not reformat, renumber, or modify it
-3. **DO NOT CREATE NUMBERED LISTS** from results array - use formatted_list field
-4. **Check for formatted_list field first** - If it exists, use it instead of results
-5. **Charts are for frontend** - acknowledge their presence but don't display base64
-6. **Example: If tool returns formatted_list, your response must include it verbatim**
+- Peak year: {peak_year} with {peak_count} dancers
+- Average: {average_dancers_per_year} dancers per year
 
 **WRONG - Creating your own list:**
 ```
@@ -400,7 +413,7 @@ Use summary_stats to provide quick insights:
 
 **CORRECT - Using formatted_list field:**
 ```
-{{Use the exact formatted_list from tool response}}
+{Use the exact formatted_list from tool response}
 ```
 
 **Example Response Structure When formatted_list Exists:**
@@ -412,39 +425,7 @@ Here are the top dancers:
 - Joey Sogluizzo leads with 47 wins
 - Strong competition in top 10
 
-## 🔒 DATA PROTECTION ENFORCEMENT
-
-**CRITICAL: All tools enforce these limits automatically:**
-
-1. **Maximum 100 records** in any list/table response (allows comprehensive rankings)
-2. **Maximum 20 sample records** when showing examples
-3. **Export/download requests blocked** at API level
-4. **No CSV generation** - analysis and insights only
-5. **Summary stats preferred** over raw data dumps
-
-**If user requests more than allowed:**
-"For data protection, I can show up to 100 results at a time.
-I'm showing you the top 100 {{items}}.
-
-To see different results, try filtering by:
-- Specific years (e.g., '2020-2024')
-- Specific divisions (e.g., 'Pro division only')
-- Different ranking criteria"
-
-**NEVER:**
-- Return all dancers/contests without filters
-- Create downloadable CSV exports
-- Show pagination through full database
-- Provide SQL-like access to raw tables
-
-## 6. RED FLAGS - When to Double-Check
-
-- If a dancer suddenly has way more/fewer wins than expected
-- If numbers don't match between "Pro wins" and "total wins"  
-- If someone asks "are you sure?" - RE-RUN your analysis in the SAME response
-- If your answer contradicts previous information - acknowledge and correct immediately
-
-## 7. COMPLETE RESPONSE EXAMPLE
+## COMPLETE RESPONSE EXAMPLE
 
 When asked "Who has the most Pro wins?", respond like this in ONE message:
 ```
@@ -476,8 +457,250 @@ When asked "Who has the most Pro wins?", respond like this in ONE message:
 
 **Context:** This counts only 1st place finishes in the Pro division. Note that some dancers may have many more entries than wins - for example, Archer Joyce has 71 Pro entries but 0 Pro wins (he has wins in other divisions like Sr Pro and Novice).
 ```
+""",
+}
+
+_EXAMPLE_TRIGGERS = {
+    "query_patterns": re.compile(r"\bwins?\b|\bwon\b|record|career|partner|win rate|how many|unique|judge|trend", re.IGNORECASE),
+    # Capitalized word pairs are usually dancer names ("Sam West")
+    "dancer_lookup": re.compile(r"(?i:record|career|partner|win rate|profile)|\b[A-Z][a-z]+ [A-Z][a-z]+"),
+    "analysis": re.compile(r"trend|by year|per year|each year|active|judge|panel|together|retention|progress|how long|percent|analy|compare", re.IGNORECASE),
+    "ranking_example": re.compile(r"\bmost\b|\btop\b|\bbest\b|\brank|\bleader", re.IGNORECASE),
+}
+
+def select_prompt_examples(user_question):
+    """Join the example banks relevant to a question (empty string if none apply)"""
+    sections = [PROMPT_EXAMPLES[name] for name, pattern in _EXAMPLE_TRIGGERS.items()
+                if pattern.search(user_question)]
+    if not sections:
+        return ""
+    return "# EXAMPLES RELEVANT TO THIS QUESTION\n\n" + "\n".join(sections)
 
-## 8. FORBIDDEN BEHAVIORS
+class ChatHandler:
+    def __init__(self):
+        self.client = None
+        self.api_key = None
+        # System prompt is constant for a given knowledge base
+        self._system_prompt = None
+        self._prompt_version_bytes = None
+        self._system_prompt_source = None
+        # Circuit breaker state: "closed" -> "open" -> "half_open" -> "closed"/"open"
+        self._cb_lock = Lock()
+        self._cb_state = "closed"
+        self._cb_failures = []
+        self._cb_opened_at = 0.0
+        self.initialize_client()
+        
+    def initialize_client(self):
+        """Initialize Anthropic client with simplified configuration for Heroku"""
+        self.api_key = os.getenv('ANTHROPIC_API_KEY')
+        if self.api_key:
+            try:
+                # CRITICAL: Disable SDK retry to use our fast-fail logic (max_retries=0)
+                self.client = Anthropic(api_key=self.api_key, max_retries=0)
+                logger.info("✅ Claude API client initialized with fast-fail retry (max_retries=0)")
+            except Exception as e:
+                logger.warning("⚠️ Failed to initialize Claude API client: %s", e)
+                self.client = None
+        else:
+            logger.warning("⚠️ ANTHROPIC_API_KEY not found - API will not work")
+    
+    def create_system_prompt(self):
+        """Create the core system prompt with data context and mandatory tool usage"""
+        return f"""You are the CSA Shag Dance Archive expert. Your job is to analyze competitive shag dancing results with PERFECT ACCURACY.
+
+# CRITICAL: YOU HAVE ACCESS TO REAL DATA
+
+You have access to a tool called `query_csa_data` that queries the actual CSA competition database with 7,868 contest records.
+
+**🚨 ABSOLUTELY MANDATORY: ZERO ESTIMATION POLICY 🚨**
+
+**For ANY statistical question, you MUST use the query_csa_data tool.**
+
+**NEVER provide specific numbers, counts, percentages, or rankings without a successful tool call.**
+
+❌ **COMPLETELY FORBIDDEN:**
+- Estimating from sample data 
+- Extrapolating from partial results
+- Using training data knowledge for statistics
+- Providing "approximate" or "around X" numbers
+- Giving specific counts without database queries
+- Making up realistic-sounding statistics
+
+✅ **ONLY ALLOWED:**
+- Exact results from query_csa_data tool calls
+- Admitting when the tool can't answer the specific question
+- Directing users to rephrase if query isn't supported
+
+**IF THE TOOL DOESN'T SUPPORT THE EXACT QUERY:**
+Say: "I cannot provide specific numbers for that query. The database tool doesn't support [specific limitation]. Please rephrase your question or I can suggest alternative queries I can run."
+
+NEVER answer statistical questions from memory or training data. ALWAYS query the actual database using the tool.
+
+**🚨 CRITICAL: RULES, BYLAWS, AND REGULATIONS 🚨**
+
+**For ANY question about CSA rules, bylaws, regulations, advancement criteria, or governance:**
+
+❌ **NEVER make up or infer rule information**
+❌ **NEVER create detailed explanations of rules not explicitly provided**  
+❌ **NEVER state specific point values, advancement criteria, or procedures unless you can quote the exact text**
+
+✅ **ONLY quote actual rule text that is explicitly provided in your knowledge base**
+✅ **If you don't have the exact rule text, say: "I don't have access to that specific rule. Please check the official CSA Rules document or contact CSA directly."**
+✅ **For complex rule questions, direct users to official CSA sources**
+
+**Example of WRONG approach:**
+"You need 100 points to advance to Pro division. Points are awarded as follows: 1st place gets X points..."
+
+**Example of CORRECT approach:**  
+"I don't have access to the complete advancement criteria in the CSA Rules. Please check the official CSA Rules and Regulations document or contact CSA directly for accurate advancement requirements."
+
+---
+
+# CRITICAL DATA RULES - FOLLOW EXACTLY
+
+## 1. WHAT COUNTS AS A "WIN"
+- A WIN = Placement column value of 1 (first place ONLY)
+- Placement values 2-8 are NOT wins
+- NEVER count total entries as wins
+- NEVER mix up different divisions
+
+## 2. DATA STRUCTURE YOU'RE WORKING WITH
+The CSV has these columns:
+- Archive ID
+- Contest  
+- Organization (CSA or NSDC)
+- Year
+- Host Club
+- **Placement** (1 = Win, 2-8 = other placements)
+- **Division** (Pro, Amateur, Novice, Junior 1, Junior 2, Sr Pro, etc.)
+- Female Name
+- Male Name
+- Couple Name
+- Judge 1-5
+- Record ID
+
+## 3. COMMON DIVISIONS
+- **Pro**: Highest competitive level
+- **Amateur**: Beginner competitors
+- **Novice**: Mid-level competitors
+- **Junior 1 & Junior 2**: Youth divisions
+- **Sr Pro**: Senior professional
+- **Non-Pro**: NSDC non-professional division
+- **Masters**: Masters division
+- **Overall**: NSDC overall placement
+
+## 4. MANDATORY SINGLE-RESPONSE FORMAT
+
+**CRITICAL: For "top dancers" questions, ALWAYS show BOTH male and female dancers unless user explicitly specifies gender.**
+
+For ANY question about wins or rankings, provide your complete answer in ONE response using this exact structure:
+
+### Part 1: Filter Logic
+```
+Filtering for:
+- Division = [specify which division]
+- Placement = 1 (wins only)
+- Organization = [CSA/NSDC/Both]
+- Gender = both (default - shows top 50 male + top 50 female)
+```
+
+### Part 2: Sample Results (3-5 rows)
+Show actual data rows that prove your filtering is correct
+
+### Part 3: Complete Results
+Present the full answer with counts, rankings, or statistics
+
+### Part 4: Context & Verification
+Note any important distinctions (entries vs wins, multiple divisions, etc.)
+
+**Do NOT split this into multiple messages. Present all four parts together in one complete response.**
+
+## 🚨 CRITICAL: SMART DANCER LOOKUP - ALWAYS USE THIS FIRST
+
+**For ANY query about a specific dancer's record, career, or statistics:**
+
+✅ **MANDATORY: Use smart_dancer_lookup query type FIRST**
+❌ **FORBIDDEN: Using dancer_record, dancer_search, or custom_query for dancer names**
+❌ **FORBIDDEN: Trying multiple query types - smart_dancer_lookup handles everything**
+
+**Why this exists:** Prevents multiple API calls. smart_dancer_lookup does exact match, partial match,
+filtering, and complete summary in ONE tool call.
+
+**What smart_dancer_lookup returns:**
+- Exact or partial name matches (both Male Name and Female Name columns)
+- Total contests, total wins, win rate percentage
+- Career span (first year to last year)
+- Division breakdown (contests and wins per division)
+- Sample recent contests
+- ALL IN ONE RESPONSE - no follow-up calls needed
+
+**NEVER use dancer_record or custom_query when asking about a dancer by name. ALWAYS use smart_dancer_lookup.**
+
+## ANALYTICAL QUERIES - Use analyze_csa_data Tool
+
+**For statistical analysis, trends, and aggregations, use analyze_csa_data (NOT query_csa_data).**
+
+Analysis types:
+- yearly_active_dancers - male/female/total active dancers per year with year-over-year change
+- judge_dancer_frequency - dancers a judge saw most often (requires judge_name)
+- judge_panel_combinations - judges who most often judge together (min_occurrences)
+- judge_dancer_outcomes - a dancer's win rate with specific judges vs overall (requires dancer_name)
+- retention_analysis - how many Amateur dancers eventually reach Pro
+- career_progression_time - average, fastest, slowest time from Amateur to Pro
+
+**CRITICAL: Use analyze_csa_data for aggregations/statistics. Use query_csa_data for individual records.**
+
+## 🎨 RICH FORMATTING AND VISUALIZATION
+
+**The analyze_csa_data and smart_dancer_lookup tools return enhanced responses with:**
+1. **formatted_table** or **formatted_list** - Pre-formatted markdown ready to display
+2. **chart_base64** - Chart as base64 data URL (when available)
+3. **summary_stats** - Key statistics dictionary
+4. **raw_data** - Underlying data for additional analysis
+
+**CRITICAL FORMATTING RULES:**
+
+1. **ALWAYS use formatted_list or formatted_table fields** - NEVER create your own lists from raw results
+2. **Copy formatted_list EXACTLY** - Do not reformat, renumber, or modify it
+3. **DO NOT CREATE NUMBERED LISTS** from results array - use formatted_list field
+4. **Check for formatted_list field first** - If it exists, use it instead of results
+5. **Charts are for frontend** - acknowledge their presence but don't display base64
+6. **Example: If tool returns formatted_list, your response must include it verbatim**
+
+## 🔒 DATA PROTECTION ENFORCEMENT
+
+**CRITICAL: All tools enforce these limits automatically:**
+
+1. **Maximum 100 records** in any list/table response (allows comprehensive rankings)
+2. **Maximum 20 sample records** when showing examples
+3. **Export/download requests blocked** at API level
+4. **No CSV generation** - analysis and insights only
+5. **Summary stats preferred** over raw data dumps
+
+**If user requests more than allowed:**
+"For data protection, I can show up to 100 results at a time.
+I'm showing you the top 100 {{items}}.
+
+To see different results, try filtering by:
+- Specific years (e.g., '2020-2024')
+- Specific divisions (e.g., 'Pro division only')
+- Different ranking criteria"
+
+**NEVER:**
+- Return all dancers/contests without filters
+- Create downloadable CSV exports
+- Show pagination through full database
+- Provide SQL-like access to raw tables
+
+## 5. RED FLAGS - When to Double-Check
+
+- If a dancer suddenly has way more/fewer wins than expected
+- If numbers don't match between "Pro wins" and "total wins"  
+- If someone asks "are you sure?" - RE-RUN your analysis in the SAME response
+- If your answer contradicts previous information - acknowledge and correct immediately
+
+## 6. FORBIDDEN BEHAVIORS
 
 ❌ NEVER count total entries as wins
 ❌ NEVER mix divisions (Pro ≠ Sr Pro ≠ Amateur)  
@@ -488,7 +711,7 @@ When asked "Who has the most Pro wins?", respond like this in ONE message:
 ❌ NEVER split your analysis across multiple chat responses
 ❌ NEVER say "Let me check..." and then provide results in a follow-up message
 
-## 9. QUALITY CHECKS (Verify BEFORE Responding)
+## 7. QUALITY CHECKS (Verify BEFORE Responding)
 
 Before sending your response, verify:
 1. Did I filter for Placement = 1? 
@@ -498,7 +721,7 @@ Before sending your response, verify:
 5. Am I distinguishing between male/female dancers correctly?
 6. Did I include ALL four parts (filter logic, sample data, results, context) in THIS response?
 
-## 10. SPECIAL CASES
+## 8. SPECIAL CASES
 
 **Partnership Changes:**
 - Same dancer with different partners = separate contest entries
@@ -614,256 +837,524 @@ If you catch yourself about to give a contradictory answer, STOP and re-analyze
 
 **Always use numbered lists for rankings and bullet points for categories. Keep it clean and readable."""
 
-    def _get_cache_key(self, user_question, system_prompt):
-        """Generate cache key for query+system prompt"""
-        content = user_question + system_prompt
-        return hashlib.md5(content.encode()).hexdigest()
+    def refresh_system_prompt(self):
+        """Rebuild the cached system prompt and its hash from the current knowledge base"""
+        self._system_prompt = self.create_system_prompt()
+        # Prompt version folded into the BLAKE2b key so the cache never hashes the prompt per query
+        self._prompt_version_bytes = hashlib.blake2b(self._system_prompt.encode(), digest_size=16).digest()
+        self._system_prompt_source = data_loader.knowledge_base
+
+    def get_system_prompt(self):
+        """Get the system prompt, rebuilt only when the knowledge base changes"""
+        if self._system_prompt is None or self._system_prompt_source is not data_loader.knowledge_base:
+            self.refresh_system_prompt()
+        return self._system_prompt
+
+    def get_context_prompt(self):
+        """Get sample-record context for the currently loaded CSV"""
+        return _sample_context_text(5, data_loader.version)
+
+    def _build_system_blocks(self, system_prompt, user_question):
+        """Build system blocks with an ephemeral cache breakpoint so Anthropic reuses the prefix"""
+        # Breakpoint goes after the constant part: tools + core prompt + sample context
+        blocks = [
+            {"type": "text", "text": system_prompt},
+            {"type": "text", "text": self.get_context_prompt(), "cache_control": {"type": "ephemeral"}}
+        ]
+        # Question-specific examples follow the cached prefix so they don't invalidate it
+        examples = select_prompt_examples(user_question)
+        if examples:
+            blocks.append({"type": "text", "text": examples})
+        return blocks
+
+    def _get_cache_key(self, user_question):
+        """Generate cache key for query, keyed by the current system prompt version"""
+        return hashlib.blake2b(user_question.encode('utf-8'), digest_size=16,
+                               key=self._prompt_version_bytes).hexdigest()
     
     def _get_cached_response(self, cache_key):
         """Get cached response if valid"""
+        global _cache_bytes_used
         with _cache_lock:
             if cache_key in _response_cache:
-                cached_data, timestamp = _response_cache[cache_key]
-                if time.time() - timestamp < CACHE_EXPIRY_SECONDS:
-                    print("⚡ Using cached response")
+                cached_data, timestamp, size = _response_cache[cache_key]
+                if time.monotonic() - timestamp < CACHE_EXPIRY_SECONDS:
+                    logger.debug("⚡ Using cached response")
+                    _response_cache.move_to_end(cache_key)
                     return cached_data
                 else:
                     # Remove expired cache entry
                     del _response_cache[cache_key]
+                    _cache_bytes_used -= size
         return None
     
     def _cache_response(self, cache_key, response):
         """Cache the response"""
+        global _cache_bytes_used
+        size = sys.getsizeof(response)
         with _cache_lock:
-            _response_cache[cache_key] = (response, time.time())
-            # Clean old entries if cache gets too big
-            if len(_response_cache) > 100:
-                oldest_key = min(_response_cache.keys(), 
-                               key=lambda k: _response_cache[k][1])
-                del _response_cache[oldest_key]
+            previous = _response_cache.pop(cache_key, None)
+            if previous is not None:
+                _cache_bytes_used -= previous[2]
+            _response_cache[cache_key] = (response, time.monotonic(), size)
+            _cache_bytes_used += size
+            # Evict least recently used entries until the cache fits its byte budget
+            while _cache_bytes_used > MAX_CACHE_BYTES and len(_response_cache) > 1:
+                _, evicted = _response_cache.popitem(last=False)
+                _cache_bytes_used -= evicted[2]
+
+    def _circuit_allows_call(self):
+        """Check the circuit breaker; an open circuit lets one probe through after cooldown"""
+        with self._cb_lock:
+            if self._cb_state == "closed":
+                return True
+            # A probe that never reports back (client disconnect mid-stream) must not hold the
+            # circuit half-open forever, so another probe goes out once a cooldown has passed
+            now = time.monotonic()
+            if now - self._cb_opened_at >= CB_OPEN_SECONDS:
+                self._cb_state = "half_open"
+                self._cb_opened_at = now
+                logger.info("🔌 Circuit breaker half-open - sending probe call")
+                return True
+            return False
+
+    def _record_api_success(self):
+        """Close the circuit after a successful call"""
+        with self._cb_lock:
+            if self._cb_state != "closed":
+                logger.info("✅ Circuit breaker closed - Anthropic API recovered")
+            self._cb_state = "closed"
+            self._cb_failures.clear()
+
+    def _record_api_failure(self):
+        """Track a failed call and open the circuit when failures pile up"""
+        with self._cb_lock:
+            now = time.monotonic()
+            if self._cb_state == "half_open":
+                self._cb_state = "open"
+                self._cb_opened_at = now
+                logger.warning("🔌 Circuit breaker probe failed - re-opening")
+                return
+
+            self._cb_failures = [t for t in self._cb_failures if now - t < CB_FAILURE_WINDOW_SECONDS]
+            self._cb_failures.append(now)
+            if len(self._cb_failures) >= CB_FAILURE_THRESHOLD:
+                self._cb_state = "open"
+                self._cb_opened_at = now
+                self._cb_failures.clear()
+                logger.warning("🔌 Circuit breaker OPEN - skipping Anthropic calls for %ss", CB_OPEN_SECONDS)
 
     def _call_anthropic_with_retry(self, **kwargs):
         """Call Anthropic API with FAST fail on rate limits for Heroku 30s timeout"""
         max_retries = 1  # Only retry once - fail fast!
 
+        if not self._circuit_allows_call():
+            logger.warning("🔌 Circuit breaker open - returning graceful error without API call")
+            return _RATE_LIMITED_RESPONSE
+
         for attempt in range(max_retries + 1):
             try:
-                return self.client.messages.create(**kwargs)
+                response = self.client.messages.create(**kwargs)
+                self._record_api_success()
+                return response
 
             except RateLimitError as e:
-                print(f"❌ Rate limit hit on attempt {attempt + 1}")
+                logger.warning("❌ Rate limit hit on attempt %d", attempt + 1)
 
                 if attempt == 0:
                     # One retry after 2 seconds
-                    print("⏸️ Waiting 2s before final attempt...")
+                    logger.info("⏸️ Waiting 2s before final attempt...")
                     time.sleep(2)
                 else:
                     # Fail immediately - don't block worker
-                    print("❌ Rate limit exceeded - returning graceful error")
-                    return type('MockResponse', (), {
-                        'content': [type('MockContent', (), {'text':
-                            "I'm experiencing high demand right now. Please try your question again in 30 seconds."})()],
-                        'stop_reason': 'rate_limited'
-                    })()
+                    logger.warning("❌ Rate limit exceeded - returning graceful error")
+                    self._record_api_failure()
+                    return _RATE_LIMITED_RESPONSE
 
             except (APITimeoutError, APIConnectionError) as e:
-                print(f"❌ Connection error: {type(e).__name__}")
-                return type('MockResponse', (), {
-                    'content': [type('MockContent', (), {'text':
-                        "Connection timeout. Please try again in a moment."})()],
-                    'stop_reason': 'timeout'
-                })()
+                logger.warning("❌ Connection error: %s", type(e).__name__)
+                self._record_api_failure()
+                return _TIMEOUT_RESPONSE
 
             except Exception as e:
-                print(f"❌ Non-retryable error: {type(e).__name__}: {e}")
-                return type('MockResponse', (), {
-                    'content': [type('MockContent', (), {'text':
-                        "I encountered an error. Please rephrase your question."})()],
-                    'stop_reason': 'error'
-                })()
-
-    def process_query(self, user_question):
-        """Process user query with Claude API and function calling"""
-        if not self.client:
-            return "Error: API not configured. Please check environment variables."
-        
+                logger.error("❌ Non-retryable error: %s: %s", type(e).__name__, e)
+                if isinstance(e, InternalServerError):
+                    self._record_api_failure()
+                else:
+                    # The API answered (bad request, auth, ...): not an outage, so a probe settles closed
+                    self._record_api_success()
+                return _ERROR_RESPONSE
+
+    def _stream_anthropic(self, **kwargs):
+        """Stream an Anthropic call, yielding text deltas and returning the final message"""
+        if not self._circuit_allows_call():
+            logger.warning("🔌 Circuit breaker open - returning graceful error without API call")
+            yield RATE_LIMITED_MESSAGE
+            return _RATE_LIMITED_RESPONSE
+
         try:
-            # Check smart cache first for cacheable queries
-            if query_cache.should_cache_query(user_question):
-                cached_response = query_cache.get(user_question)
-                if cached_response:
-                    print(f"🎯 Smart cache HIT for query: {user_question[:50]}...")
-                    return cached_response
+            with self.client.messages.stream(**kwargs) as stream:
+                for text in stream.text_stream:
+                    yield text
+                response = stream.get_final_message()
+            self._record_api_success()
+            return response
+
+        except RateLimitError:
+            logger.warning("❌ Rate limit hit while streaming - returning graceful error")
+            self._record_api_failure()
+            yield RATE_LIMITED_MESSAGE
+            return _RATE_LIMITED_RESPONSE
+
+        except (APITimeoutError, APIConnectionError) as e:
+            logger.warning("❌ Connection error while streaming: %s", type(e).__name__)
+            self._record_api_failure()
+            yield TIMEOUT_MESSAGE
+            return _TIMEOUT_RESPONSE
+
+        except Exception as e:
+            logger.error("❌ Non-retryable streaming error: %s: %s", type(e).__name__, e)
+            if isinstance(e, InternalServerError):
+                self._record_api_failure()
+            else:
+                self._record_api_success()
+            yield GENERIC_ERROR_MESSAGE
+            return _ERROR_RESPONSE
+
+    def _tool_call_key(self, tool_use):
+        """Canonical key for a tool call so identical calls can share one result"""
+        if ORJSON_AVAILABLE:
+            try:
+                canonical = orjson.dumps(tool_use.input, option=orjson.OPT_SORT_KEYS)
+            except TypeError:
+                canonical = json.dumps(tool_use.input, sort_keys=True, default=str)
+        else:
+            canonical = json.dumps(tool_use.input, sort_keys=True, default=str)
+        # Same (path, mtime) token tools.py keys its frame on, so a replaced CSV invalidates results
+        return (tool_use.name, canonical, archive_version())
+
+    def _run_tool(self, tool_use, key=None):
+        """Execute a single tool call and return its serialized result"""
+        if key is None:
+            key = self._tool_call_key(tool_use)
+        with _tool_cache_lock:
+            content = _tool_result_cache.get(key)
+            if content is not None:
+                _tool_result_cache.move_to_end(key)
+                logger.debug("⚡ Reusing cached result for %s", tool_use.name)
+                return content
+        
+        logger.debug("🔧 Executing: %s with %s", tool_use.name, tool_use.input)
+        
+        tool_result = None
+        if tool_use.name == "query_csa_data":
+            tool_result = execute_query_csa_data(
+                query_type=tool_use.input.get("query_type"),
+                filters=tool_use.input.get("filters", {}),
+                limit=tool_use.input.get("limit", 10)
+            )
+            logger.debug("✅ Tool result: %s", tool_result.get('message', 'Success'))
+
+        elif tool_use.name == "analyze_csa_data":
+            tool_result = execute_analyze_csa_data(
+                analysis_type=tool_use.input.get("analysis_type"),
+                filters=tool_use.input.get("filters", {}),
+                limit=tool_use.input.get("limit", 20)
+            )
+            logger.debug("✅ Analysis result: %s", tool_result.get('analysis', 'Success'))
+
+        if not tool_result:
+            tool_result = {"error": "Tool execution failed"}
+        
+        content = serialize_tool_result(tool_result)
+        
+        # Only successful results are worth replaying for other calls
+        if "error" not in tool_result:
+            with _tool_cache_lock:
+                _tool_result_cache[key] = content
+                _tool_result_cache.move_to_end(key)
+                while len(_tool_result_cache) > MAX_TOOL_CACHE_ENTRIES:
+                    _tool_result_cache.popitem(last=False)
+        
+        return content
+
+    def _execute_tool(self, tool_use):
+        """Execute a single tool call and build its tool_result block"""
+        return {
+            "type": "tool_result",
+            "tool_use_id": tool_use.id,
+            "content": self._run_tool(tool_use)
+        }
+
+    def _execute_tools(self, tool_uses):
+        """Execute every tool call from one model turn, concurrently when there are several"""
+        if len(tool_uses) == 1:
+            return [self._execute_tool(tool_uses[0])]
+        
+        # Identical (name, input) calls in the same turn run once and share the result;
+        # keys are computed once so a CSV swap mid-turn can't split them
+        keys = [self._tool_call_key(tool_use) for tool_use in tool_uses]
+        unique = {}
+        for key, tool_use in zip(keys, tool_uses):
+            unique.setdefault(key, tool_use)
+        
+        # Tools only read the archive data, so they can run side by side; map keeps order
+        contents = dict(zip(unique, _TOOL_EXECUTOR.map(self._run_tool, unique.values(), unique)))
+        
+        return [
+            {
+                "type": "tool_result",
+                "tool_use_id": tool_use.id,
+                "content": contents[key]
+            }
+            for key, tool_use in zip(keys, tool_uses)
+        ]
+
+    def _message_kwargs(self, system_blocks, messages):
+        """Arguments for a messages call in the tool-use loop"""
+        return {
+            "model": "claude-sonnet-4-5-20250929",
+            "max_tokens": 3000,
+            "system": system_blocks,
+            "messages": messages,
+            # History with tool_use blocks must still declare the tools
+            "tools": TOOLS,
+        }
+
+    def _run_tool_conversation(self, user_question, system_prompt):
+        """Run the Claude tool-use loop for a query and return the final text"""
+        # System prompt plus recent data context, cached server-side across tool-loop turns
+        system_blocks = self._build_system_blocks(system_prompt, user_question)
+        
+        # Initialize messages
+        messages = [{"role": "user", "content": user_question}]
+        
+        logger.debug("🎯 Processing query: %s", user_question)
+        
+        # Initial API call with tools using retry logic
+        response = self._call_anthropic_with_retry(
+            **self._message_kwargs(system_blocks, messages)
+        )
+        
+        logger.debug("🔄 Initial response stop reason: %s", response.stop_reason)
+        
+        # Handle tool calls
+        while response.stop_reason == "tool_use":
+            logger.debug("🔧 Processing tool calls...")
             
-            system_prompt = self.create_system_prompt()
+            # Find ALL tool use blocks
+            tool_uses = [block for block in response.content if getattr(block, 'type', None) == "tool_use"]
             
-            # Check legacy cache as fallback
-            cache_key = self._get_cache_key(user_question, system_prompt)
-            cached_response = self._get_cached_response(cache_key)
-            if cached_response:
-                print(f"🎯 Legacy cache HIT for query: {user_question[:50]}...")
-                return cached_response
+            if not tool_uses:
+                logger.warning("⚠️ No tool use blocks found")
+                break
             
-            # Add some recent data context for better answers
-            sample_data = data_loader.get_csv_sample(5)
-            context_prompt = f"\n\nHere are some recent contest records for context:\n{sample_data}"
+            logger.debug("🛠️ Found %d tool calls", len(tool_uses))
             
-            # Initialize messages
-            messages = [{"role": "user", "content": user_question}]
+            # Add assistant response to messages first
+            messages.append({"role": "assistant", "content": response.content})
             
-            print(f"🎯 Processing query: {user_question}")
+            # Execute ALL tools and collect results
+            tool_results = self._execute_tools(tool_uses)
             
-            # Initial API call with tools using retry logic
+            # Add ALL tool results in a single user message
+            messages.append({
+                "role": "user",
+                "content": tool_results
+            })
+            
+            logger.debug("🔄 Continuing conversation with all tool results...")
+            
+            # Continue conversation
+            _compact_tool_results(messages)
             response = self._call_anthropic_with_retry(
-                model="claude-sonnet-4-5-20250929",
-                max_tokens=3000,
-                system=system_prompt + context_prompt,
-                messages=messages,
-                tools=TOOLS
+                **self._message_kwargs(system_blocks, messages)
             )
             
-            print(f"🔄 Initial response stop reason: {response.stop_reason}")
+            logger.debug("🔄 Follow-up response stop reason: %s", response.stop_reason)
+        
+        # Extract final text response
+        final_text = "".join(block.text for block in response.content
+                             if getattr(block, 'type', None) == "text")
+        return final_text
+
+    def _lookup_caches(self, user_question, query_lower):
+        """Check the smart and legacy caches; returns (cached_response, system_prompt, cache_key)"""
+        # Check smart cache first for cacheable queries
+        if query_cache.should_cache_query(user_question, query_lower):
+            cached_response = query_cache.get(user_question, query_lower=query_lower)
+            if cached_response:
+                logger.info("🎯 Smart cache HIT for query: %.50s...", user_question)
+                return cached_response, None, None
+        
+        system_prompt = self.get_system_prompt()
+        
+        # Check legacy cache as fallback
+        cache_key = self._get_cache_key(user_question)
+        cached_response = self._get_cached_response(cache_key)
+        if cached_response:
+            logger.info("🎯 Legacy cache HIT for query: %.50s...", user_question)
+        return cached_response, system_prompt, cache_key
+
+    def get_cached_answer(self, user_question, query_lower=None):
+        """Cached answer for this question, or None - repeats can be served without a Claude call"""
+        if not self.client:
+            return None
+        if query_lower is None:
+            query_lower = normalize_query(user_question)
+        cached_response, _, _ = self._lookup_caches(user_question, query_lower)
+        return cached_response
+
+    def _store_response(self, user_question, query_lower, cache_key, final_text):
+        """Cache successful responses in both systems"""
+        # Canned fallbacks (rate limited, timeout, ...) describe this moment, not the question
+        if final_text and not final_text.startswith("Error:") and len(final_text) > 50 \
+                and final_text not in _FALLBACK_MESSAGES:
+            # Store in legacy cache
+            self._cache_response(cache_key, final_text)
             
-            # Handle tool calls
-            while response.stop_reason == "tool_use":
-                print("🔧 Processing tool calls...")
+            # Store in smart cache if query is cacheable
+            if query_cache.should_cache_query(user_question, query_lower):
+                # Use longer TTL for statistical queries that don't change often
+                ttl = 600 if _LONG_TTL_RE.search(query_lower) else 300
+                query_cache.set(user_question, final_text, ttl=ttl, query_lower=query_lower)
+                logger.debug("💾 Cached query in smart cache (TTL: %ss)", ttl)
+
+    def _error_message(self, e):
+        """Log a query processing error and map it to a user-friendly message"""
+        error_type = type(e).__name__
+        error_msg = str(e)
+        logger.error("🔥 CHAT HANDLER ERROR: %s: %s", error_type, error_msg)
+        # Stack trace formatting is only paid for when DEBUG logging is on
+        logger.debug("📍 STACK TRACE", exc_info=True)
+        
+        # Provide user-friendly error messages with more detail
+        message = _ERROR_MESSAGES.get(error_type)
+        if message:
+            return message
+        if error_type == "NotFoundError" and "model" in error_msg:
+            return "AI model configuration issue. Please contact support."
+        if error_type == "FileNotFoundError":
+            return "Database file not found. Please contact support to restore data files."
+        # Return more specific error information for debugging
+        return f"Processing error ({error_type}): {error_msg[:100]}. Please try rephrasing your question or contact support if this persists."
+
+    def stream_query(self, user_question, query_lower=None):
+        """Process user query like process_query, yielding answer text as Claude generates it
+        
+        Text from turns that end in tool calls ("Let me look that up") has already reached the
+        client by the time the tool call shows up, so it stays part of the answer: turns are
+        joined with a blank line, and that same joined text is what gets cached.
+        """
+        if not self.client:
+            yield API_NOT_CONFIGURED_MESSAGE
+            return
+        
+        streamed = []
+        try:
+            if query_lower is None:
+                query_lower = normalize_query(user_question)
+            cached_response, system_prompt, cache_key = self._lookup_caches(user_question, query_lower)
+            if cached_response:
+                yield cached_response
+                return
+            
+            system_blocks = self._build_system_blocks(system_prompt, user_question)
+            messages = [{"role": "user", "content": user_question}]
+            
+            logger.debug("🎯 Streaming query: %s", user_question)
+            
+            while True:
+                turn = self._stream_anthropic(**self._message_kwargs(system_blocks, messages))
+                separator = TURN_SEPARATOR if streamed else ""
+                try:
+                    while True:
+                        try:
+                            text = next(turn)
+                        except StopIteration as stop:
+                            response = stop.value
+                            break
+                        if text:
+                            text, separator = separator + text, ""
+                            streamed.append(text)
+                            yield text
+                finally:
+                    # A client disconnect closes us mid-turn; close the Anthropic stream with it
+                    turn.close()
                 
-                # Find ALL tool use blocks
-                tool_uses = []
-                for block in response.content:
-                    if hasattr(block, 'type') and block.type == "tool_use":
-                        tool_uses.append(block)
+                if response.stop_reason != "tool_use":
+                    break
                 
+                tool_uses = [block for block in response.content if getattr(block, 'type', None) == "tool_use"]
                 if not tool_uses:
-                    print("⚠️ No tool use blocks found")
+                    logger.warning("⚠️ No tool use blocks found")
                     break
                 
-                print(f"🛠️ Found {len(tool_uses)} tool calls")
-                
-                # Add assistant response to messages first
+                logger.debug("🛠️ Found %d tool calls", len(tool_uses))
                 messages.append({"role": "assistant", "content": response.content})
-                
-                # Execute ALL tools and collect results
-                tool_results = []
-                for tool_use in tool_uses:
-                    print(f"🔧 Executing: {tool_use.name} with {tool_use.input}")
-                    
-                    tool_result = None
-                    if tool_use.name == "query_csa_data":
-                        tool_result = execute_query_csa_data(
-                            query_type=tool_use.input.get("query_type"),
-                            filters=tool_use.input.get("filters", {}),
-                            limit=tool_use.input.get("limit", 10)
-                        )
-                        print(f"✅ Tool result: {tool_result.get('message', 'Success')}")
-
-                    elif tool_use.name == "analyze_csa_data":
-                        tool_result = execute_analyze_csa_data(
-                            analysis_type=tool_use.input.get("analysis_type"),
-                            filters=tool_use.input.get("filters", {}),
-                            limit=tool_use.input.get("limit", 20)
-                        )
-                        print(f"✅ Analysis result: {tool_result.get('analysis', 'Success')}")
-
-                    if not tool_result:
-                        tool_result = {"error": "Tool execution failed"}
-                    
-                    # Add this tool result to the collection
-                    tool_results.append({
-                        "type": "tool_result",
-                        "tool_use_id": tool_use.id,
-                        "content": json.dumps(convert_to_json_serializable(tool_result), indent=2)
-                    })
-                
-                # Add ALL tool results in a single user message
-                messages.append({
-                    "role": "user",
-                    "content": tool_results
-                })
-                
-                print("🔄 Continuing conversation with all tool results...")
-                
-                # Continue conversation
-                response = self._call_anthropic_with_retry(
-                    model="claude-sonnet-4-5-20250929",
-                    max_tokens=3000,
-                    system=system_prompt + context_prompt,
-                    messages=messages,
-                    tools=TOOLS
-                )
-                
-                print(f"🔄 Follow-up response stop reason: {response.stop_reason}")
+                messages.append({"role": "user", "content": self._execute_tools(tool_uses)})
+                _compact_tool_results(messages)
             
-            # Extract final text response
-            final_text = ""
-            for block in response.content:
-                if hasattr(block, 'text'):
-                    final_text += block.text
+            # Cache exactly the text the client received (fallback messages are skipped by _store_response)
+            if response.stop_reason not in _FALLBACK_STOP_REASONS:
+                self._store_response(user_question, query_lower, cache_key, "".join(streamed))
+            logger.debug("✅ Streaming query complete")
             
-            # Cache successful responses in both systems
-            if final_text and not final_text.startswith("Error:") and len(final_text) > 50:
-                # Store in legacy cache
-                self._cache_response(cache_key, final_text)
-                
-                # Store in smart cache if query is cacheable
-                if query_cache.should_cache_query(user_question):
-                    # Use longer TTL for statistical queries that don't change often
-                    ttl = 600 if any(pattern in user_question.lower() for pattern in 
-                        ['who has the most', 'top dancers', 'win rate', 'career statistics']) else 300
-                    query_cache.set(user_question, final_text, ttl=ttl)
-                    print(f"💾 Cached query in smart cache (TTL: {ttl}s)")
+        except Exception as e:
+            message = self._error_message(e)
+            yield TURN_SEPARATOR + message if streamed else message
+
+    def process_query(self, user_question, query_lower=None):
+        """Process user query with Claude API and function calling
+        
+        query_lower: optional normalize_query(user_question), if the caller already has it
+        """
+        # No client: bail out before any prompt building, hashing or cache lookups
+        if not self.client:
+            return API_NOT_CONFIGURED_MESSAGE
+        
+        try:
+            if query_lower is None:
+                query_lower = normalize_query(user_question)
+            cached_response, system_prompt, cache_key = self._lookup_caches(user_question, query_lower)
+            if cached_response:
+                return cached_response
             
-            print("✅ Query processing complete")
-            return final_text
+            # Single-flight: identical concurrent queries wait for one Anthropic call
+            with _cache_lock:
+                flight = _inflight.get(cache_key)
+                is_leader = flight is None
+                if is_leader:
+                    flight = _inflight[cache_key] = _InFlightQuery()
             
-        except Exception as e:
-            error_type = type(e).__name__
-            error_msg = str(e)
-            print(f"🔥 CHAT HANDLER ERROR: {error_type}: {error_msg}")
-            print(f"🔍 FULL ERROR DETAILS: {repr(e)}")
+            if not is_leader:
+                logger.info("⏳ Identical query already in flight, waiting: %.50s...", user_question)
+                if flight.event.wait(timeout=INFLIGHT_WAIT_SECONDS) and flight.result:
+                    return flight.result
+                logger.warning("⚠️ In-flight query produced no result - processing independently")
+            
+            try:
+                final_text = self._run_tool_conversation(user_question, system_prompt)
+                flight.result = final_text
+            finally:
+                if is_leader:
+                    with _cache_lock:
+                        _inflight.pop(cache_key, None)
+                    flight.event.set()
             
-            # Import traceback for better debugging
-            import traceback
-            print(f"📍 STACK TRACE: {traceback.format_exc()}")
+            self._store_response(user_question, query_lower, cache_key, final_text)
             
-            # Provide user-friendly error messages with more detail
-            if "BadRequestError" in error_type:
-                return "Invalid request format. Please rephrase your question and try again."
-            elif "RateLimitError" in error_type:
-                return "Too many requests. Please wait a moment before asking another question."
-            elif "APIConnectionError" in error_type:
-                return "Connection issue with AI service. Please try again in a moment."
-            elif "APITimeoutError" in error_type:
-                return "Request timed out. Your question might be too complex. Please try a simpler query."
-            elif "AuthenticationError" in error_type:
-                return "AI service authentication issue. Please contact support."
-            elif "NotFoundError" in error_type and "model" in error_msg:
-                return "AI model configuration issue. Please contact support."
-            elif "ImportError" in error_type or "ModuleNotFoundError" in error_type:
-                return "System configuration issue. Please contact support."
-            elif "FileNotFoundError" in error_type:
-                return "Database file not found. Please contact support to restore data files."
-            else:
-                # Return more specific error information for debugging
-                return f"Processing error ({error_type}): {error_msg[:100]}. Please try rephrasing your question or contact support if this persists."
+            logger.debug("✅ Query processing complete")
+            return final_text
+            
+        except Exception as e:
+            return self._error_message(e)
 
-def convert_to_json_serializable(obj):
-    """Convert pandas types to JSON-serializable formats"""
-    if isinstance(obj, dict):
-        return {key: convert_to_json_serializable(value) for key, value in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_to_json_serializable(item) for item in obj]
-    # Handle numpy types without importing numpy (check type name)
-    elif type(obj).__name__ in ('int64', 'int32', 'int_'):
-        return int(obj)
-    elif type(obj).__name__ in ('float64', 'float32', 'float_'):
-        return float(obj)
-    elif type(obj).__name__ == 'ndarray':
-        return obj.tolist()
-    elif hasattr(obj, 'item'):  # numpy scalar
-        return obj.item()
-    else:
-        return obj
+    async def process_query_async(self, user_question, query_lower=None):
+        """Awaitable process_query, so async callers can run several questions concurrently"""
+        # The sync client, retry, circuit breaker and single-flight logic all stay shared;
+        # tool calls within a turn already run in parallel on _TOOL_EXECUTOR
+        return await asyncio.to_thread(self.process_query, user_question, query_lower)
 
 # Global instance  
 chat_handler = ChatHandler()
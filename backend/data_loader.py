@@ -1,13 +1,46 @@
+import hashlib
+import pickle
+import numpy as np
 import pandas as pd
 import PyPDF2
+try:
+    import pypdfium2 as pdfium
+    PDFIUM_AVAILABLE = True
+except ImportError:
+    # Fall back to pure-Python PyPDF2 extraction
+    pdfium = None
+    PDFIUM_AVAILABLE = False
 import os
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import repeat
+
+# Bump when the cached structures or knowledge base format change
+KB_CACHE_FORMAT = 4
+
+# Characters of each rules PDF included in the knowledge base
+PDF_PREFIX_CHARS = 2000
+
+# Rules documents: (knowledge base key, file in data/)
+PDF_FILES = [
+    ("CSA_Bylaws", "ByLawsCompleted10-2020.pdf"),
+    ("CSA_Rules", "CSARulesAndRegsREVISED120223.pdf"),
+    ("NSDC_Rules", "NSDC NATIONAL SHAG DANCE CHAMPIONSHIP RULES.pdf"),
+    ("NSDC_Songs", "NSDC Required Song List.pdf")
+]
+
+# Columns covered by search_contests
+SEARCH_COLUMNS = ['Contest', 'Host Club', 'Division', 'Female Name', 'Male Name', 'Couple Name']
 
 class DataLoader:
     def __init__(self):
         self.csv_data = None
         self.pdf_content = {}
         self.knowledge_base = ""
+        self._search_blob = None  # Lowercased SEARCH_COLUMNS text per row, built on load
+        self._summary_stats = None  # (version, stats) from get_summary_stats
+        self.version = 0  # Bumped on every CSV load so dependent caches can invalidate
         
         # Get the data directory path relative to this file
         # This ensures it works whether running from backend/ or repo root
@@ -17,9 +50,67 @@ class DataLoader:
         
     def load_all_data(self):
         """Load CSV and extract all PDF content"""
+        # Inputs only change when files are replaced, so reuse the last build if they match
+        cache_key = self._data_fingerprint()
+        if self._load_cache(cache_key):
+            return
+        
         self.load_csv()
         self.extract_all_pdfs()
         self.create_knowledge_base()
+        self._save_cache(cache_key)
+        
+    def _data_fingerprint(self):
+        """Hash of the data files' names, sizes and mtimes"""
+        if not self.data_dir.exists():
+            return None
+        files = sorted(
+            (p.name, p.stat().st_mtime_ns, p.stat().st_size)
+            for p in self.data_dir.iterdir()
+            if p.suffix.lower() in {'.pdf', '.csv', '.parquet'}
+        )
+        return hashlib.sha256(repr((KB_CACHE_FORMAT, files)).encode()).hexdigest()
+        
+    def _load_cache(self, cache_key):
+        """Restore CSV data, PDF text and knowledge base from the disk cache"""
+        cache_path = self.data_dir / ".kb_cache.pkl"
+        if cache_key is None or not cache_path.exists():
+            return False
+        try:
+            with cache_path.open('rb') as f:
+                cached = pickle.load(f)
+        except Exception as e:
+            print(f"⚠️ Ignoring unreadable data cache: {e}")
+            return False
+        # Key first, so a cache written by an older format is just a miss
+        if cached[0] != cache_key:
+            return False
+        _, csv_data, search_blob, summary_stats, pdf_content, knowledge_base = cached
+        
+        self.csv_data = csv_data
+        self._search_blob = search_blob
+        self.pdf_content = pdf_content
+        self.knowledge_base = knowledge_base
+        self.version += 1
+        self._summary_stats = (self.version, summary_stats)
+        print(f"⚡ Loaded data from cache: {len(self.csv_data)} contest records, "
+              f"{len(self.knowledge_base)} character knowledge base")
+        return True
+        
+    def _save_cache(self, cache_key):
+        """Write the loaded data to the disk cache for the next start"""
+        if cache_key is None or self.csv_data is None:
+            return
+        cache_path = self.data_dir / ".kb_cache.pkl"
+        tmp_path = cache_path.with_suffix('.tmp')
+        try:
+            with tmp_path.open('wb') as f:
+                pickle.dump((cache_key, self.csv_data, self._search_blob, self.get_summary_stats(),
+                             self.pdf_content, self.knowledge_base),
+                            f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)  # Atomic, so concurrent workers never read a partial file
+        except Exception as e:
+            print(f"⚠️ Could not write data cache: {e}")
         
     def load_csv(self):
         """Load the main contest archive CSV"""
@@ -30,56 +121,157 @@ class DataLoader:
                 print(f"📁 Directory contents: {list(self.data_dir.glob('*')) if self.data_dir.exists() else 'Directory does not exist'}")
                 return
                 
-            self.csv_data = pd.read_csv(csv_path)
+            self.csv_data = self._read_parquet_snapshot(csv_path)
+            if self.csv_data is None:
+                self.csv_data = self._read_csv(csv_path)
+            self._search_blob = self._build_search_blob(self.csv_data)
+            self.version += 1
             print(f"✅ Loaded CSV: {len(self.csv_data)} contest records")
         except Exception as e:
             print(f"❌ Error loading CSV: {e}")
             
-    def extract_pdf_text(self, pdf_path):
-        """Extract text from a single PDF file"""
+    def _read_csv(self, csv_path):
+        """Parse the archive CSV, with Arrow's multithreaded reader when available"""
+        try:
+            # Same frame as the default C parser (object strings, int64 numbers), parsed faster
+            return pd.read_csv(csv_path, engine='pyarrow')
+        except ImportError:
+            # The C parser reads the file through a memory map instead of buffered reads
+            return pd.read_csv(csv_path, memory_map=True)
+            
+    def _read_parquet_snapshot(self, csv_path):
+        """Load the Parquet copy of the CSV (scripts/build_parquet.py) if it matches the CSV"""
+        parquet_path = csv_path.with_suffix('.parquet')
+        if not parquet_path.exists():
+            return None
         try:
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-                return text.strip()
+            df = pd.read_parquet(parquet_path)
+        except Exception as e:
+            # e.g. pyarrow not installed - the CSV is always authoritative
+            print(f"⚠️ Could not read Parquet snapshot, using CSV: {e}")
+            return None
+        # Content hash rather than mtime: git checkouts don't preserve mtimes
+        csv_hash = hashlib.sha256(csv_path.read_bytes()).hexdigest()
+        if df.attrs.get('source_csv_sha256') != csv_hash:
+            print("⚠️ Parquet snapshot is stale - rerun scripts/build_parquet.py; using CSV")
+            return None
+        print("⚡ Using Parquet snapshot of the archive")
+        # Same frame read_csv gives: categoricals back to object (value_counts breaks ties by
+        # category order otherwise, changing the knowledge base), missing strings as NaN not None
+        text_columns = [col for col in df.columns if df[col].dtype == object or isinstance(df[col].dtype, pd.CategoricalDtype)]
+        df = df.astype({col: object for col in text_columns} | {col: 'int64' for col in df.select_dtypes('integer').columns})
+        df[text_columns] = df[text_columns].fillna(np.nan)
+        return df
+            
+    @staticmethod
+    def extract_pdf_text(pdf_path, max_chars=None):
+        """Extract text from a single PDF file
+        
+        max_chars: stop reading pages once this much text is available and return only that prefix
+        """
+        def enough(pages):
+            return max_chars is not None and len("".join(pages).lstrip()) >= max_chars
+        
+        try:
+            pages = []
+            if PDFIUM_AVAILABLE:
+                # Native PDFium text extraction; much faster than PyPDF2
+                pdf = pdfium.PdfDocument(str(pdf_path))
+                try:
+                    for page in pdf:
+                        if pages:
+                            pages.append("\n")
+                        pages.append(page.get_textpage().get_text_range().replace("\r\n", "\n"))
+                        if enough(pages):
+                            break
+                finally:
+                    pdf.close()
+            else:
+                with open(pdf_path, 'rb') as file:
+                    pdf_reader = PyPDF2.PdfReader(file)
+                    for page in pdf_reader.pages:
+                        pages.append(page.extract_text() + "\n")
+                        if enough(pages):
+                            break
+            
+            text = "".join(pages).strip()
+            return text[:max_chars] if max_chars is not None else text
         except Exception as e:
             print(f"❌ Error extracting PDF {pdf_path}: {e}")
             return ""
             
     def extract_all_pdfs(self):
-        """Extract text from all PDF files in data directory"""
-        pdf_files = [
-            ("CSA_Bylaws", "ByLawsCompleted10-2020.pdf"),
-            ("CSA_Rules", "CSARulesAndRegsREVISED120223.pdf"), 
-            ("NSDC_Rules", "NSDC NATIONAL SHAG DANCE CHAMPIONSHIP RULES.pdf"),
-            ("NSDC_Songs", "NSDC Required Song List.pdf")
-        ]
-        
-        for key, filename in pdf_files:
+        """Extract the start of each rules PDF in the data directory
+        
+        Only the first PDF_PREFIX_CHARS go into the knowledge base, so that is all that is
+        read and kept; get_full_pdf re-extracts a whole document on demand.
+        """
+        found = []
+        for key, filename in PDF_FILES:
             pdf_path = self.data_dir / filename
             if pdf_path.exists():
-                text = self.extract_pdf_text(pdf_path)
-                self.pdf_content[key] = text
-                print(f"✅ Extracted PDF: {key} ({len(text)} characters)")
+                found.append((key, pdf_path))
             else:
                 print(f"❌ PDF not found: {filename} at {pdf_path.absolute()}")
+        
+        # PyPDF2 is pure Python and holds the GIL, so parse files in separate processes
+        workers = min(len(found), os.cpu_count() or 1)
+        texts = None
+        if workers > 1:
+            try:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    texts = list(executor.map(DataLoader.extract_pdf_text,
+                                              [str(path) for _, path in found],
+                                              repeat(PDF_PREFIX_CHARS)))
+            except Exception as e:
+                print(f"⚠️ Parallel PDF extraction failed, falling back to serial: {e}")
+        if texts is None:
+            texts = [self.extract_pdf_text(path, PDF_PREFIX_CHARS) for _, path in found]
+        
+        for (key, _), text in zip(found, texts):
+            self.pdf_content[key] = text
+            print(f"✅ Extracted PDF: {key} ({len(text)} characters)")
+    
+    @lru_cache(maxsize=len(PDF_FILES))
+    def get_full_pdf(self, key):
+        """Full text of one rules PDF by key (e.g. 'CSA_Rules'), extracted on first use"""
+        filename = dict(PDF_FILES).get(key)
+        if filename is None or not (self.data_dir / filename).exists():
+            return ""
+        return self.extract_pdf_text(self.data_dir / filename)
                 
+    def get_summary_stats(self):
+        """Archive-wide counts for the knowledge base, computed once per data version"""
+        if self.csv_data is None:
+            return None
+        if self._summary_stats is not None and self._summary_stats[0] == self.version:
+            return self._summary_stats[1]
+            
+        stats = {
+            'total_records': len(self.csv_data),
+            'years': f"{self.csv_data['Year'].min()}-{self.csv_data['Year'].max()}",
+            'organizations': self.csv_data['Organization'].value_counts(),
+            'divisions': self.csv_data['Division'].value_counts(),
+            'top_contests': self.csv_data['Contest'].value_counts().head(10),
+            # Top competitors
+            'top_couples': self.csv_data['Couple Name'].value_counts().head(15),
+        }
+        self._summary_stats = (self.version, stats)
+        return stats
+        
     def create_knowledge_base(self):
         """Create a comprehensive knowledge base string"""
         if self.csv_data is None:
             return
             
         # CSV Data Summary
-        total_records = len(self.csv_data)
-        years = f"{self.csv_data['Year'].min()}-{self.csv_data['Year'].max()}"
-        organizations = self.csv_data['Organization'].value_counts()
-        divisions = self.csv_data['Division'].value_counts()
-        top_contests = self.csv_data['Contest'].value_counts().head(10)
-        
-        # Top competitors
-        top_couples = self.csv_data['Couple Name'].value_counts().head(15)
+        stats = self.get_summary_stats()
+        total_records = stats['total_records']
+        years = stats['years']
+        organizations = stats['organizations']
+        divisions = stats['divisions']
+        top_contests = stats['top_contests']
+        top_couples = stats['top_couples']
         
         knowledge_base = f"""
 COMPETITIVE SHAGGERS ASSOCIATION (CSA) ARCHIVE DATABASE
@@ -107,17 +299,20 @@ MAJOR ORGANIZATIONS:
 
 """
         
+        parts = [knowledge_base]
+        
         # Add PDF content
         if self.pdf_content:
-            knowledge_base += "\nRULES AND REGULATIONS CONTENT:\n"
-            knowledge_base += "=" * 50 + "\n\n"
+            parts.append("\nRULES AND REGULATIONS CONTENT:\n")
+            parts.append("=" * 50 + "\n\n")
             
             for key, content in self.pdf_content.items():
                 if content:
-                    knowledge_base += f"{key.replace('_', ' ').upper()}:\n"
-                    knowledge_base += content[:2000] + "\n\n"  # First 2000 chars of each PDF
+                    parts.append(f"{key.replace('_', ' ').upper()}:\n")
+                    parts.append(content[:PDF_PREFIX_CHARS])  # Only the start of each PDF
+                    parts.append("\n\n")
                     
-        self.knowledge_base = knowledge_base
+        self.knowledge_base = "".join(parts)
         print(f"✅ Knowledge base created: {len(self.knowledge_base)} characters")
         
     def get_csv_sample(self, n=10):
@@ -126,24 +321,32 @@ MAJOR ORGANIZATIONS:
             return self.csv_data.head(n).to_dict('records')
         return []
         
+    def _build_search_blob(self, df):
+        """Join the searchable text columns into one lowercased string per row"""
+        columns = [col for col in SEARCH_COLUMNS if col in df.columns]
+        if not columns:
+            return None
+        # Unit separator keeps a term from matching across two columns
+        # object first: categorical columns can't be filled with a value outside their categories
+        blob = df[columns[0]].astype(object).fillna('').astype(str)
+        for col in columns[1:]:
+            blob = blob.str.cat(df[col].astype(object).fillna('').astype(str), sep='\x1f')
+        return blob.str.lower()
+        
     def search_contests(self, query_terms):
         """Simple search in contest data"""
-        if self.csv_data is None:
+        if self.csv_data is None or self._search_blob is None:
             return []
+        if not query_terms:
+            return self.csv_data.head(20).to_dict('records')
             
-        results = self.csv_data.copy()
-        
-        # Simple text search across string columns
-        text_columns = ['Contest', 'Host Club', 'Division', 'Female Name', 'Male Name', 'Couple Name']
-        
+        # Every term must appear somewhere in the row: one literal substring pass per term
+        mask = None
         for term in query_terms:
-            mask = False
-            for col in text_columns:
-                if col in results.columns:
-                    mask |= results[col].str.contains(term, case=False, na=False)
-            results = results[mask]
+            term_mask = self._search_blob.str.contains(str(term).lower(), regex=False)
+            mask = term_mask if mask is None else mask & term_mask
             
-        return results.head(20).to_dict('records')
+        return self.csv_data.loc[mask].head(20).to_dict('records')
 
 # Global instance
 data_loader = DataLoader()
\ No newline at end of file
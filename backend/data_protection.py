@@ -3,6 +3,8 @@ Data Protection Layer
 Enforces limits and prevents raw data extraction
 """
 
+import re
+
 class DataProtectionError(Exception):
     """Raised when a query violates data protection rules"""
     pass
@@ -18,26 +20,33 @@ class DataProtector:
         'full database', 'complete list', 'entire dataset'
     ]
 
+    # Compiled once; substring semantics match the original `pattern in question` checks
+    _FORBIDDEN_RE = re.compile('|'.join(map(re.escape, FORBIDDEN_PATTERNS)))
+    _BROAD_RE = re.compile('all|every')
+    _ENTITY_RE = re.compile('dancer|contest|record|entry')
+    _ALLOWED_RE = re.compile('top|best|most|analysis|trend')
+
     @staticmethod
-    def validate_query(user_question: str) -> tuple:
+    def validate_query(user_question: str, question_lower: str = None) -> tuple:
         """
         Check if query attempts to extract raw data
+        question_lower: optional precomputed lowercase form of the question
         Returns: (is_valid, error_message)
         """
-        question_lower = user_question.lower()
+        if question_lower is None:
+            question_lower = user_question.lower()
 
         # Check for forbidden patterns
-        for pattern in DataProtector.FORBIDDEN_PATTERNS:
-            if pattern in question_lower:
-                return (False,
-                    f"This system provides statistical insights and analysis, not raw data exports. "
-                    f"Please ask for specific analysis like 'top 10 winners' or 'trends by year'.")
+        if DataProtector._FORBIDDEN_RE.search(question_lower):
+            return (False,
+                f"This system provides statistical insights and analysis, not raw data exports. "
+                f"Please ask for specific analysis like 'top 10 winners' or 'trends by year'.")
 
         # Check for suspicious requests for all data
         # BUT allow individual dancer/contest lookups with "complete" or "record"
-        if any(word in question_lower for word in ['all', 'every']) and \
-           any(word in question_lower for word in ['dancer', 'contest', 'record', 'entry']):
-            if not any(word in question_lower for word in ['top', 'best', 'most', 'analysis', 'trend']):
+        if DataProtector._BROAD_RE.search(question_lower) and \
+           DataProtector._ENTITY_RE.search(question_lower):
+            if not DataProtector._ALLOWED_RE.search(question_lower):
                 return (False,
                     "For data protection, I can provide top lists, statistics, and analysis - "
                     "but not complete unfiltered datasets. Try: 'top 100 Pro dancers' or 'analyze retention rates'.")
@@ -2,22 +2,90 @@ import sqlite3
 import os
 from datetime import datetime
 import json
+import time
+import queue
+import atexit
+import threading
+from contextlib import closing, contextmanager
 from pathlib import Path
 
 DATABASE_PATH = os.path.join(os.path.dirname(__file__), 'csa_archive.db')
 
+# Background query-log writer: flush every LOG_BATCH_SIZE rows or LOG_FLUSH_SECONDS
+LOG_BATCH_SIZE = 200
+LOG_FLUSH_SECONDS = 0.1
+LOG_QUEUE_SIZE = 10000
+
+# Query ids are reserved from SQLite in blocks, so processes never hand out the same id
+QUERY_ID_BLOCK_SIZE = 100
+# How long feedback waits for its query's row to be written by the background writer
+FEEDBACK_WAIT_SECONDS = 2.0
+
+# Queued in place of a row to tell the writer thread to write what it holds and exit
+_STOP_WRITER = object()
+WRITER_JOIN_SECONDS = 5
+
+_INSERT_QUERY_WITH_ID = '''
+    INSERT INTO queries 
+    (id, user_id, ip_address, question, response, response_time_ms, tool_calls_used, session_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+_INSERT_QUERY = '''
+    INSERT INTO queries 
+    (user_id, ip_address, question, response, response_time_ms, tool_calls_used, session_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
 class DatabaseManager:
     def __init__(self):
         self.db_path = DATABASE_PATH
+        self._lock = threading.Lock()
+        # Opened lazily per process: a SQLite connection must not be carried across fork()
+        # (gunicorn --preload builds this in the master, then forks the worker)
+        self._conn = None
+        self._conn_pid = None
         self.init_database()
+        
+        # Query log writer state, set up lazily per process (gunicorn forks after --preload)
+        self._log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        self._writer_lock = threading.Lock()
+        self._writer_pid = None
+        self._writer_thread = None
+        self._next_query_id = 0  # next id in this process's reserved block
+        self._query_id_end = 0   # first id past the block
+        # Ids handed out but not yet written, so feedback can wait for its row
+        self._pending_ids = set()
+        self._log_written = threading.Condition()
     
-    def get_connection(self):
-        """Get database connection"""
-        return sqlite3.connect(self.db_path, timeout=30.0)
+    def _open_connection(self):
+        """Open a connection tuned for many small writes"""
+        conn = sqlite3.connect(self.db_path, timeout=30.0, check_same_thread=False)
+        # WAL + NORMAL: commits append to the log instead of fsyncing the main file each time
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA mmap_size=268435456')
+        return conn
+    
+    @contextmanager
+    def _tx(self):
+        """Serialize use of this process's connection; commit on success, roll back on error"""
+        with self._lock:
+            if self._conn_pid != os.getpid():
+                self._conn = self._open_connection()
+                self._conn_pid = os.getpid()
+            conn = self._conn
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
     
     def init_database(self):
         """Initialize database with required tables"""
-        with self.get_connection() as conn:
+        # Own short-lived connection, so importing this module leaves no connection open to fork
+        with closing(self._open_connection()) as conn:
             cursor = conn.cursor()
             
             # Users table
@@ -72,13 +140,36 @@ class DatabaseManager:
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_queries_user ON queries (user_id)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_queries_timestamp ON queries (timestamp)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_feedback_query ON feedback (query_id)')
+            # Newest-first admin listings (keyset pagination on timestamp, id)
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_queries_ts_id ON queries (timestamp DESC, id DESC, user_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_feedback_ts_id ON feedback (timestamp DESC, id DESC)')
+            
+            # Keep users.total_queries in step with query inserts inside the engine
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_queries_count
+                AFTER INSERT ON queries
+                WHEN NEW.user_id IS NOT NULL
+                BEGIN
+                    UPDATE users
+                    SET total_queries = total_queries + 1, last_seen = CURRENT_TIMESTAMP
+                    WHERE id = NEW.user_id;
+                END
+            ''')
+            
+            # Query ids are reserved by advancing the AUTOINCREMENT sequence (see _reserve_query_ids),
+            # which needs the queries row in sqlite_sequence to exist before the first insert
+            cursor.execute('''
+                INSERT INTO sqlite_sequence (name, seq)
+                SELECT 'queries', COALESCE(MAX(id), 0) FROM queries
+                WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'queries')
+            ''')
             
             conn.commit()
             print("✅ Database initialized successfully")
     
     def register_user(self, name, email, ip_address, user_agent=None, device_fingerprint=None):
         """Register new user or update existing one"""
-        with self.get_connection() as conn:
+        with self._tx() as conn:
             cursor = conn.cursor()
             
             # Check if user exists by IP and name
@@ -113,7 +204,7 @@ class DatabaseManager:
     
     def find_user(self, ip_address, name=None):
         """Find user by IP address and optionally name"""
-        with self.get_connection() as conn:
+        with self._tx() as conn:
             cursor = conn.cursor()
             
             if name:
@@ -133,35 +224,147 @@ class DatabaseManager:
     
     def log_query(self, user_id, ip_address, question, response, response_time_ms=None, 
                   tool_calls_used=None, session_id=None):
-        """Log a user query with full details"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Insert query log
-            cursor.execute('''
-                INSERT INTO queries 
-                (user_id, ip_address, question, response, response_time_ms, tool_calls_used, session_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (user_id, ip_address, question, response, response_time_ms, 
-                  json.dumps(tool_calls_used) if tool_calls_used else None, session_id))
-            
-            query_id = cursor.lastrowid
-            
-            # Update user query count
-            if user_id:
-                cursor.execute('''
-                    UPDATE users 
-                    SET total_queries = total_queries + 1, last_seen = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                ''', (user_id,))
-            
-            conn.commit()
-            print(f"✅ Logged query {query_id} for user {user_id}")
-            return query_id
+        """Log a user query with full details
+        
+        The row is written by a background thread; the id is assigned up front
+        so it can be returned to the client for feedback right away.
+        """
+        self._ensure_writer()
+        with self._writer_lock:
+            if self._next_query_id >= self._query_id_end:
+                self._reserve_query_ids()
+            query_id = self._next_query_id
+            self._next_query_id += 1
+        with self._log_written:
+            self._pending_ids.add(query_id)
+        
+        row = (query_id, user_id, ip_address, question, response, response_time_ms,
+               json.dumps(tool_calls_used) if tool_calls_used else None, session_id)
+        try:
+            self._log_queue.put_nowait(row)
+        except queue.Full:
+            # Writer can't keep up - write inline rather than drop the log
+            self._write_query_rows([row])
+        return query_id
+    
+    def _ensure_writer(self):
+        """Start the query-log writer for this process if it isn't running"""
+        if self._writer_pid == os.getpid():
+            return
+        with self._writer_lock:
+            if self._writer_pid == os.getpid():
+                return
+            # Ids reserved by the parent process before the fork belong to the parent
+            self._next_query_id = self._query_id_end = 0
+            self._writer_thread = threading.Thread(target=self._drain_loop, name="query-log-writer", daemon=True)
+            self._writer_thread.start()
+            atexit.register(self.flush_query_log)
+            self._writer_pid = os.getpid()
+    
+    def _reserve_query_ids(self):
+        """Claim the next QUERY_ID_BLOCK_SIZE query ids for this process (caller holds _writer_lock)
+        
+        Advancing the AUTOINCREMENT sequence inside one write transaction means no other
+        process and no autoincrement insert can ever be given an id from the block.
+        """
+        with self._tx() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('''
+                UPDATE sqlite_sequence
+                SET seq = MAX(seq, (SELECT COALESCE(MAX(id), 0) FROM queries)) + ?
+                WHERE name = 'queries'
+            ''', (QUERY_ID_BLOCK_SIZE,))
+            block_end = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'queries'").fetchone()[0]
+        self._next_query_id = block_end - QUERY_ID_BLOCK_SIZE + 1
+        self._query_id_end = block_end + 1
+    
+    def _drain_loop(self):
+        """Write queued query logs in batches"""
+        stopping = False
+        while not stopping:
+            row = self._log_queue.get()
+            if row is _STOP_WRITER:
+                break
+            batch = [row]
+            deadline = time.monotonic() + LOG_FLUSH_SECONDS
+            while len(batch) < LOG_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    row = self._log_queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if row is _STOP_WRITER:
+                    stopping = True
+                    break
+                batch.append(row)
+            self._write_query_rows(batch)
+    
+    def flush_query_log(self):
+        """Write any queued query logs now (called at exit)"""
+        # Stop the writer first: a batch it is holding would otherwise die with the daemon thread
+        thread = self._writer_thread
+        if thread is not None and self._writer_pid == os.getpid() and thread.is_alive():
+            try:
+                self._log_queue.put(_STOP_WRITER, timeout=WRITER_JOIN_SECONDS)
+                thread.join(WRITER_JOIN_SECONDS)
+            except queue.Full:
+                print("⚠️ Query log writer did not drain in time - writing the remaining rows inline")
+            self._writer_pid = None
+        
+        batch = []
+        while True:
+            try:
+                row = self._log_queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is not _STOP_WRITER:
+                batch.append(row)
+        self._write_query_rows(batch)
+    
+    def _write_query_rows(self, rows):
+        """Insert query log rows (with preassigned ids) in one transaction"""
+        if not rows:
+            return
+        try:
+            with self._tx() as conn:
+                conn.executemany(_INSERT_QUERY_WITH_ID, rows)
+            print(f"✅ Logged {len(rows)} queries (last id {rows[-1][0]})")
+        except Exception as e:
+            # Never renumber: the ids were already returned to clients for feedback
+            print(f"❌ Failed to write {len(rows)} query logs: {e}")
+        finally:
+            with self._log_written:
+                self._pending_ids.difference_update(row[0] for row in rows)
+                self._log_written.notify_all()
+    
+    def log_queries_bulk(self, rows):
+        """Log many queries in one transaction
+        
+        rows: (user_id, ip_address, question, response, response_time_ms, tool_calls_used, session_id)
+        """
+        rows = [
+            (user_id, ip_address, question, response, response_time_ms,
+             json.dumps(tool_calls_used) if tool_calls_used else None, session_id)
+            for user_id, ip_address, question, response, response_time_ms, tool_calls_used, session_id in rows
+        ]
+        if not rows:
+            return 0
+        
+        with self._tx() as conn:
+            conn.executemany(_INSERT_QUERY, rows)
+        
+        print(f"✅ Logged {len(rows)} queries")
+        return len(rows)
     
     def log_feedback(self, query_id, user_id, feedback_type='incorrect_answer', comment=None, ip_address=None):
         """Log user feedback on a query response"""
-        with self.get_connection() as conn:
+        # Feedback can arrive before the background writer has stored its query
+        with self._log_written:
+            self._log_written.wait_for(lambda: query_id not in self._pending_ids, timeout=FEEDBACK_WAIT_SECONDS)
+        
+        with self._tx() as conn:
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -176,27 +379,19 @@ class DatabaseManager:
     
     def get_user_stats(self):
         """Get user statistics"""
-        with self.get_connection() as conn:
+        with self._tx() as conn:
             cursor = conn.cursor()
             
-            # Total users
-            cursor.execute('SELECT COUNT(*) FROM users')
-            total_users = cursor.fetchone()[0]
-            
-            # Total queries
-            cursor.execute('SELECT COUNT(*) FROM queries')
-            total_queries = cursor.fetchone()[0]
-            
-            # Total feedback reports
-            cursor.execute('SELECT COUNT(*) FROM feedback')
-            total_feedback = cursor.fetchone()[0]
-            
-            # Recent activity (last 24 hours)
+            # All four counts in one statement
             cursor.execute('''
-                SELECT COUNT(*) FROM queries 
-                WHERE timestamp > datetime('now', '-1 day')
+                SELECT
+                    (SELECT COUNT(*) FROM users),
+                    (SELECT COUNT(*) FROM queries),
+                    (SELECT COUNT(*) FROM feedback),
+                    -- Recent activity (last 24 hours)
+                    (SELECT COUNT(*) FROM queries WHERE timestamp > datetime('now', '-1 day'))
             ''')
-            recent_queries = cursor.fetchone()[0]
+            total_users, total_queries, total_feedback, recent_queries = cursor.fetchone()
             
             return {
                 'total_users': total_users,
@@ -205,9 +400,12 @@ class DatabaseManager:
                 'recent_queries': recent_queries
             }
     
-    def get_recent_queries(self, limit=50):
-        """Get recent queries for admin review"""
-        with self.get_connection() as conn:
+    def get_recent_queries(self, limit=50, before_ts=None, before_id=None):
+        """Get recent queries for admin review
+        
+        Pass the timestamp and id of the last row seen to get the next page.
+        """
+        with self._tx() as conn:
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -215,16 +413,20 @@ class DatabaseManager:
                        q.response, q.timestamp, q.tool_calls_used
                 FROM queries q
                 LEFT JOIN users u ON q.user_id = u.id
-                ORDER BY q.timestamp DESC
+                WHERE ? IS NULL OR (q.timestamp, q.id) < (?, ?)
+                ORDER BY q.timestamp DESC, q.id DESC
                 LIMIT ?
-            ''', (limit,))
+            ''', (before_ts, before_ts, before_id if before_id is not None else -1, limit))
             
             columns = ['id', 'name', 'email', 'ip_address', 'question', 'response', 'timestamp', 'tool_calls_used']
             return [dict(zip(columns, row)) for row in cursor.fetchall()]
     
-    def get_feedback_reports(self, limit=50):
-        """Get recent feedback reports for admin review"""
-        with self.get_connection() as conn:
+    def get_feedback_reports(self, limit=50, before_ts=None, before_id=None):
+        """Get recent feedback reports for admin review
+        
+        Pass the timestamp and id of the last row seen to get the next page.
+        """
+        with self._tx() as conn:
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -233,9 +435,10 @@ class DatabaseManager:
                 FROM feedback f
                 LEFT JOIN queries q ON f.query_id = q.id
                 LEFT JOIN users u ON f.user_id = u.id
-                ORDER BY f.timestamp DESC
+                WHERE ? IS NULL OR (f.timestamp, f.id) < (?, ?)
+                ORDER BY f.timestamp DESC, f.id DESC
                 LIMIT ?
-            ''', (limit,))
+            ''', (before_ts, before_ts, before_id if before_id is not None else -1, limit))
             
             columns = ['id', 'query_id', 'name', 'email', 'question', 'response', 'feedback_type', 'comment', 'timestamp']
             return [dict(zip(columns, row)) for row in cursor.fetchall()]
@@ -2,77 +2,118 @@
 Query result caching to reduce redundant API calls and improve performance
 """
 
-import hashlib
+import re
 import time
 import json
-from typing import Optional, Dict, Any
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional, Dict, Any, Tuple
+
+# Statistical queries that are likely to be repeated
+CACHE_PATTERNS = [
+    'who has the most',
+    'how many wins',
+    'top dancers',
+    'win rate',
+    'career statistics',
+    'partnership analysis',
+    'contest results',
+    'judge statistics',
+    'what are the rules',
+    'division system',
+    'advancement criteria'
+]
+
+# Very specific or time-sensitive queries that shouldn't be cached
+NO_CACHE_PATTERNS = [
+    'current',
+    'today',
+    'recent',
+    'latest',
+    'this year',
+    'register',
+    'feedback'
+]
+
+# One alternation per list: a single scan of the query instead of a substring search per pattern
+_CACHE_RE = re.compile('|'.join(map(re.escape, CACHE_PATTERNS)))
+_NO_CACHE_RE = re.compile('|'.join(map(re.escape, NO_CACHE_PATTERNS)))
+
+def normalize_query(query: str) -> str:
+    """Normalized form used for cache keys and pattern checks; compute once per request"""
+    return query.strip().lower()
 
 class QueryCache:
-    """In-memory cache for query results with TTL"""
+    """In-memory LRU cache for query results with TTL"""
     
-    def __init__(self, default_ttl=300):  # 5 minutes default
-        self.cache = {}
+    def __init__(self, default_ttl=300, max_entries=1024):  # 5 minutes default
+        self.cache = OrderedDict()  # Least recently used first
         self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self._lock = Lock()
     
-    def _generate_key(self, query: str, user_context: Optional[str] = None) -> str:
+    def _generate_key(self, query: str, user_context: Optional[str] = None,
+                      query_lower: Optional[str] = None) -> Tuple[str, str]:
         """Generate a cache key from query and optional context"""
-        cache_string = f"{query.strip().lower()}"
-        if user_context:
-            cache_string += f"|{user_context}"
-        return hashlib.md5(cache_string.encode()).hexdigest()
+        if query_lower is None:
+            query_lower = normalize_query(query)
+        # A plain tuple hashes in C; no need for a cryptographic digest in-process
+        return (query_lower, user_context or '')
     
-    def get(self, query: str, user_context: Optional[str] = None) -> Optional[str]:
+    def get(self, query: str, user_context: Optional[str] = None,
+            query_lower: Optional[str] = None) -> Optional[str]:
         """Get cached result if exists and not expired"""
-        key = self._generate_key(query, user_context)
-        
-        if key not in self.cache:
-            return None
-        
-        entry = self.cache[key]
-        current_time = time.time()
-        
-        # Check if expired
-        if current_time > entry['expires_at']:
-            del self.cache[key]
-            return None
-        
-        # Update access time
-        entry['last_accessed'] = current_time
-        entry['access_count'] += 1
-        
-        print(f"🎯 Cache HIT for query (accessed {entry['access_count']} times)")
+        key = self._generate_key(query, user_context, query_lower)
+        
+        with self._lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                return None
+            
+            # Check if expired
+            if time.monotonic() > entry['expires_at']:
+                del self.cache[key]
+                return None
+            
+            self.cache.move_to_end(key)
+            entry['access_count'] += 1
+            access_count = entry['access_count']
+        
+        print(f"🎯 Cache HIT for query (accessed {access_count} times)")
         return entry['result']
     
-    def set(self, query: str, result: str, user_context: Optional[str] = None, ttl: Optional[int] = None) -> None:
+    def set(self, query: str, result: str, user_context: Optional[str] = None, ttl: Optional[int] = None,
+            query_lower: Optional[str] = None) -> None:
         """Cache a query result with TTL"""
-        key = self._generate_key(query, user_context)
-        current_time = time.time()
+        key = self._generate_key(query, user_context, query_lower)
+        current_time = time.monotonic()
         
         if ttl is None:
             ttl = self.default_ttl
         
-        self.cache[key] = {
-            'result': result,
-            'created_at': current_time,
-            'last_accessed': current_time,
-            'expires_at': current_time + ttl,
-            'access_count': 1,
-            'query': query[:100]  # Store first 100 chars for debugging
-        }
+        with self._lock:
+            self.cache[key] = {
+                'result': result,
+                'expires_at': current_time + ttl,
+                'access_count': 1
+            }
+            self.cache.move_to_end(key)
+            
+            # Bounded memory: drop least recently used entries past the cap
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
         
         print(f"💾 Cached query result (TTL: {ttl}s)")
     
     def clear_expired(self) -> int:
         """Remove expired entries and return count removed"""
-        current_time = time.time()
-        expired_keys = []
+        current_time = time.monotonic()
         
-        for key, entry in self.cache.items():
-            if current_time > entry['expires_at']:
-                expired_keys.append(key)
-        
-        for key in expired_keys:
-            del self.cache[key]
+        with self._lock:
+            expired_keys = [key for key, entry in self.cache.items()
+                            if current_time > entry['expires_at']]
+            for key in expired_keys:
+                del self.cache[key]
         
         if expired_keys:
             print(f"🧹 Cleaned {len(expired_keys)} expired cache entries")
@@ -81,18 +122,19 @@ class QueryCache:
     
     def clear_all(self) -> None:
         """Clear all cache entries"""
-        count = len(self.cache)
-        self.cache.clear()
+        with self._lock:
+            count = len(self.cache)
+            self.cache.clear()
         print(f"🗑️ Cleared all {count} cache entries")
     
     def get_stats(self) -> Dict[str, Any]:
         """Get cache statistics"""
-        current_time = time.time()
+        current_time = time.monotonic()
         active_entries = 0
         expired_entries = 0
         total_accesses = 0
         
-        for entry in self.cache.values():
+        for entry in list(self.cache.values()):
             if current_time > entry['expires_at']:
                 expired_entries += 1
             else:
@@ -107,45 +149,18 @@ class QueryCache:
             'hit_rate_estimate': total_accesses / max(active_entries, 1)
         }
     
-    def should_cache_query(self, query: str) -> bool:
+    def should_cache_query(self, query: str, query_lower: Optional[str] = None) -> bool:
         """Determine if a query should be cached based on patterns"""
-        query_lower = query.lower().strip()
-        
-        # Cache statistical queries that are likely to be repeated
-        cache_patterns = [
-            'who has the most',
-            'how many wins',
-            'top dancers', 
-            'win rate',
-            'career statistics',
-            'partnership analysis',
-            'contest results',
-            'judge statistics',
-            'what are the rules',
-            'division system',
-            'advancement criteria'
-        ]
-        
-        # Don't cache very specific or time-sensitive queries
-        no_cache_patterns = [
-            'current',
-            'today',
-            'recent',
-            'latest',
-            'this year',
-            'register',
-            'feedback'
-        ]
+        if query_lower is None:
+            query_lower = normalize_query(query)
         
         # Check no-cache patterns first
-        for pattern in no_cache_patterns:
-            if pattern in query_lower:
-                return False
+        if _NO_CACHE_RE.search(query_lower):
+            return False
         
         # Check cache patterns
-        for pattern in cache_patterns:
-            if pattern in query_lower:
-                return True
+        if _CACHE_RE.search(query_lower):
+            return True
         
         # Default: cache queries longer than 20 chars (likely substantial questions)
         return len(query_lower) > 20
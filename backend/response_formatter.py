@@ -3,6 +3,9 @@ Response Formatting Utilities
 Creates rich markdown tables, charts, and formatted responses
 """
 
+from itertools import islice
+from operator import itemgetter
+
 class MarkdownFormatter:
 
     @staticmethod
@@ -19,22 +22,50 @@ class MarkdownFormatter:
 
         # Get headers from first row
         headers = list(data[0].keys())
+        headers_set = set(headers)
+
+        # Header row, separator, then data rows
+        lines = [
+            "| " + " | ".join(str(h) for h in headers) + " |",
+            "|" + "|".join("---" for _ in headers) + "|",
+        ]
+        # Rows normally share the first row's keys; fall back to .get only for ragged rows
+        # (itemgetter only returns a tuple for two or more keys)
+        getter = itemgetter(*headers) if len(headers) > 1 else lambda row: tuple(row[h] for h in headers)
+        for row in data:
+            if row.keys() >= headers_set:
+                values = getter(row)
+            else:
+                values = [row.get(h, "") for h in headers]
+            lines.append("| " + " | ".join(map(str, values)) + " |")
 
-        # Create header row
-        table = "| " + " | ".join(str(h) for h in headers) + " |\n"
+        # Add note if data was truncated
+        if len(data) == max_rows:
+            lines.append(f"\n*Showing top {max_rows} results for data protection*")
 
-        # Create separator
-        table += "|" + "|".join("---" for _ in headers) + "|\n"
+        return "\n".join(lines) + "\n"
 
-        # Create data rows
-        for row in data:
-            table += "| " + " | ".join(str(row.get(h, "")) for h in headers) + " |\n"
+    @staticmethod
+    def create_table_from_rows(rows, headers: list, max_rows: int = 100) -> str:
+        """
+        Create markdown table from tuple rows in header order
+        Same output as create_table without building a dict per row
+        """
+        lines = [
+            "| " + " | ".join(str(h) for h in headers) + " |",
+            "|" + "|".join("---" for _ in headers) + "|",
+        ]
+        lines.extend("| " + " | ".join(map(str, row)) + " |" for row in islice(rows, max_rows))
+
+        row_count = len(lines) - 2
+        if row_count == 0:
+            return "*No data to display*"
 
         # Add note if data was truncated
-        if len(data) == max_rows:
-            table += f"\n*Showing top {max_rows} results for data protection*\n"
+        if row_count == max_rows:
+            lines.append(f"\n*Showing top {max_rows} results for data protection*")
 
-        return table
+        return "\n".join(lines) + "\n"
 
     @staticmethod
     def create_ranked_list(data: list, name_key: str, value_key: str,
@@ -48,29 +79,25 @@ class MarkdownFormatter:
 
         data = data[:max_items]
 
-        result = ""
-        for i, item in enumerate(data, 1):
-            name = item.get(name_key, "Unknown")
-            value = item.get(value_key, 0)
-            result += f"{i}. **{name}** - {value} {value_label}\n"
+        lines = [
+            f"{i}. **{item.get(name_key, 'Unknown')}** - {item.get(value_key, 0)} {value_label}"
+            for i, item in enumerate(data, 1)
+        ]
 
         if len(data) == max_items:
-            result += f"\n*Top {max_items} shown*\n"
+            lines.append(f"\n*Top {max_items} shown*")
 
-        return result
+        return "\n".join(lines) + "\n"
 
     @staticmethod
     def create_stats_card(title: str, stats: dict) -> str:
         """
         Create formatted statistics card
         """
-        card = f"### {title}\n\n"
-        for label, value in stats.items():
-            # Format label nicely
-            label_formatted = label.replace('_', ' ').title()
-            card += f"**{label_formatted}:** {value}\n"
-        card += "\n"
-        return card
+        # Format labels nicely
+        lines = [f"### {title}\n"]
+        lines.extend(f"**{label.replace('_', ' ').title()}:** {value}" for label, value in stats.items())
+        return "\n".join(lines) + "\n\n"
 
     @staticmethod
     def create_comparison_table(items: list, labels: list) -> str:
@@ -80,20 +107,19 @@ class MarkdownFormatter:
         if not items or len(items) != len(labels):
             return "*Invalid comparison data*"
 
-        table = "| Metric | " + " | ".join(labels) + " |\n"
-        table += "|--------|" + "|".join("--------" for _ in labels) + "|\n"
+        lines = [
+            "| Metric | " + " | ".join(labels) + " |",
+            "|--------|" + "|".join("--------" for _ in labels) + "|",
+        ]
 
         # Get all unique keys
-        all_keys = set()
-        for item in items:
-            all_keys.update(item.keys())
+        all_keys = set().union(*items)
 
         for key in sorted(all_keys):
             key_formatted = key.replace('_', ' ').title()
-            values = [str(item.get(key, "N/A")) for item in items]
-            table += f"| {key_formatted} | " + " | ".join(values) + " |\n"
+            lines.append(f"| {key_formatted} | " + " | ".join(str(item.get(key, "N/A")) for item in items) + " |")
 
-        return table
+        return "\n".join(lines) + "\n"
 
     @staticmethod
     def format_percentage(value: float, decimals: int = 1) -> str:
@@ -1,9 +1,14 @@
+import re
 import time
+from collections import OrderedDict, deque
 from functools import wraps
 from flask import request, jsonify
 
-# Rate limiting storage (in-memory for simplicity)
-request_counts = {}
+# Rate limiting storage (in-memory for simplicity), least recently seen IP first
+MAX_TRACKED_IPS = 10000
+request_counts = OrderedDict()
+# IPs over their limit, mapped to when their oldest request leaves the window
+blocked_until = {}
 
 # Blocked query patterns
 BLOCKED_PATTERNS = [
@@ -13,6 +18,19 @@ BLOCKED_PATTERNS = [
     "all contests", "every contest", "complete list",
     "bulk export", "data dump", "full archive"
 ]
+_BLOCKED_RE = re.compile('|'.join(re.escape(p) for p in BLOCKED_PATTERNS))
+
+# Response limits: longer answers are cut, answers with this many lines look like data dumps
+MAX_RESPONSE_CHARS = 5000
+MAX_RESPONSE_LINES = 100
+KEPT_RESPONSE_LINES = 50
+
+def _rate_limited_response():
+    """429 response for a rate-limited client"""
+    return jsonify({
+        "error": "Rate limit exceeded. Please wait before making more requests.",
+        "status": "rate_limited"
+    }), 429
 
 def rate_limit(max_requests=3, window_minutes=1):
     """Rate limiting decorator"""
@@ -20,58 +38,77 @@ def rate_limit(max_requests=3, window_minutes=1):
         @wraps(func)
         def wrapper(*args, **kwargs):
             client_ip = request.remote_addr
-            current_time = time.time()
-            window_start = current_time - (window_minutes * 60)
+            current_time = time.monotonic()
             
-            # Initialize or clean old requests for this IP
-            if client_ip not in request_counts:
-                request_counts[client_ip] = []
+            # Known-blocked IPs are turned away without touching their request history
+            if client_ip in blocked_until:
+                if current_time < blocked_until[client_ip]:
+                    return _rate_limited_response()
+                del blocked_until[client_ip]
             
-            # Remove old requests outside the window
-            request_counts[client_ip] = [
-                req_time for req_time in request_counts[client_ip] 
-                if req_time > window_start
-            ]
+            window_start = current_time - (window_minutes * 60)
+            
+            # Request times for this IP, oldest first; drop those outside the window
+            times = request_counts.get(client_ip)
+            if times is None:
+                times = request_counts[client_ip] = deque()
+                # Forget the least recently seen IPs so memory stays bounded
+                while len(request_counts) > MAX_TRACKED_IPS:
+                    stale_ip, _ = request_counts.popitem(last=False)
+                    blocked_until.pop(stale_ip, None)
+            else:
+                request_counts.move_to_end(client_ip)
+            while times and times[0] <= window_start:
+                times.popleft()
             
             # Check if limit exceeded
-            if len(request_counts[client_ip]) >= max_requests:
-                return jsonify({
-                    "error": "Rate limit exceeded. Please wait before making more requests.",
-                    "status": "rate_limited"
-                }), 429
+            if len(times) >= max_requests:
+                blocked_until[client_ip] = times[0] + window_minutes * 60
+                return _rate_limited_response()
             
             # Add current request
-            request_counts[client_ip].append(current_time)
+            times.append(current_time)
             
             return func(*args, **kwargs)
         return wrapper
     return decorator
 
-def validate_input(query):
+def validate_input(query, query_lower=None):
     """Validate user input for security"""
-    query_lower = query.lower()
-    
-    # Check for blocked patterns
-    for pattern in BLOCKED_PATTERNS:
-        if pattern in query_lower:
-            return False, f"Query contains restricted pattern: '{pattern}'"
-    
-    # Check query length
+    # Check query length first so oversized input is never lowercased or scanned
     if len(query) > 1000:
         return False, "Query too long. Please keep questions concise."
     
+    if query_lower is None:
+        query_lower = query.lower()
+    
+    # Check for blocked patterns
+    match = _BLOCKED_RE.search(query_lower)
+    if match:
+        return False, f"Query contains restricted pattern: '{match.group(0)}'"
+    
     return True, "Valid"
 
 def filter_response(response_text):
     """Filter and limit response content"""
     # Limit response length
-    max_length = 5000
-    if len(response_text) > max_length:
-        response_text = response_text[:max_length] + "\n\n[Response truncated for length]"
+    if len(response_text) > MAX_RESPONSE_CHARS:
+        response_text = response_text[:MAX_RESPONSE_CHARS] + "\n\n[Response truncated for length]"
     
     # Check for potential data dumps (simple heuristic)
-    lines = response_text.split('\n')
-    if len(lines) > 100:  # Too many lines suggests data dump
-        response_text = '\n'.join(lines[:50]) + "\n\n[Response truncated - too many results]"
+    if response_text.count('\n') >= MAX_RESPONSE_LINES:  # More than 100 lines suggests data dump
+        # Only split off the 50 lines we keep
+        lines = response_text.split('\n', KEPT_RESPONSE_LINES)
+        response_text = '\n'.join(lines[:KEPT_RESPONSE_LINES]) + "\n\n[Response truncated - too many results]"
     
-    return response_text
\ No newline at end of file
+    return response_text
+
+def streamable_prefix(response_text):
+    """Longest prefix of a partial response that filter_response keeps however the response ends"""
+    prefix = response_text[:MAX_RESPONSE_CHARS]
+    cut = -1
+    for _ in range(KEPT_RESPONSE_LINES):
+        cut = prefix.find('\n', cut + 1)
+        if cut == -1:
+            return prefix
+    return prefix[:cut]
\ No newline at end of file
@@ -8,7 +8,37 @@ When we hit the limit, that's it - no more messages until tomorrow.
 
 import sqlite3
 import os
-from datetime import datetime
+import queue
+import atexit
+import threading
+import time
+from collections import Counter
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta
+
+# Background writer batching: flush after this many records or this many seconds
+WRITE_BATCH_SIZE = 500
+WRITE_BATCH_SECONDS = 0.05
+
+# Read-only connections per process; WAL lets them read while the writer commits
+READ_POOL_SIZE = 2
+
+# Queued in place of a date to tell the writer thread to commit what it holds and exit
+_STOP_WRITER = object()
+WRITER_JOIN_SECONDS = 5
+
+# Statements kept as constants so the connection's statement cache reuses the prepared forms
+_SELECT_COUNT = 'SELECT message_count FROM simple_daily_count WHERE date = ?'
+_UPSERT_COUNT = '''
+    INSERT INTO simple_daily_count (date, message_count) VALUES (?, ?)
+    ON CONFLICT(date) DO UPDATE SET message_count = message_count + excluded.message_count
+'''
+_SELECT_RECENT_DAYS = '''
+    SELECT date, message_count 
+    FROM simple_daily_count 
+    ORDER BY date DESC 
+    LIMIT 7
+'''
 
 class SimpleDailyLimiter:
     def __init__(self, db_path: str, daily_limit: int = None):
@@ -18,36 +48,120 @@ class SimpleDailyLimiter:
             self.daily_limit = int(os.getenv('DAILY_MESSAGE_LIMIT', '25'))
         else:
             self.daily_limit = daily_limit
+        self._build_messages()
+        
+        self._today = ('', 0.0)  # (date string, timestamp it stops being today)
+        
+        # Reader pool, rebuilt per process (gunicorn forks after --preload)
+        self._pool_lock = threading.Lock()
+        self._read_pool = None
+        self._pool_pid = None
         self.init_table()
+        
+        # Today's count lives in memory; SQLite is only read once per day per process
+        # and written behind by a background thread
+        self._lock = threading.Lock()
+        self._loaded_key = None  # (date, pid) the in-memory count belongs to
+        self._today_count = 0
+        self._write_queue = queue.Queue()
+        self._writer_pid = None
+        self._writer_thread = None
+        self._rejection = None  # last limit-reached response, reused while the count is unchanged
+    
+    def _build_messages(self):
+        """Pre-format the status messages for the current limit"""
+        self._allowed_messages = [
+            f'Message allowed. {remaining} messages remaining today.'
+            for remaining in range(self.daily_limit + 1)
+        ]
+        self._limit_message = f'Daily limit of {self.daily_limit} messages reached. Try again tomorrow!'
+    
+    def _open_connection(self):
+        """Open a connection tuned for a small, hot counter table"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=256)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-16000')
+        conn.execute('PRAGMA busy_timeout=5000')
+        conn.execute('PRAGMA mmap_size=268435456')
+        # Refresh planner statistics if they are missing or stale (cheap when nothing changed)
+        conn.execute('PRAGMA optimize')
+        return conn
+    
+    @contextmanager
+    def _reader(self):
+        """Check out one of this process's read-only connections"""
+        if self._pool_pid != os.getpid():
+            with self._pool_lock:
+                if self._pool_pid != os.getpid():
+                    pool = queue.Queue()
+                    for _ in range(READ_POOL_SIZE):
+                        conn = self._open_connection()
+                        conn.execute('PRAGMA query_only=1')
+                        pool.put(conn)
+                    self._read_pool = pool
+                    self._pool_pid = os.getpid()
+        conn = self._read_pool.get()
+        try:
+            yield conn
+        finally:
+            self._read_pool.put(conn)
     
     def init_table(self):
         """Initialize simple daily counter table"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS simple_daily_count (
-                    date TEXT PRIMARY KEY,
-                    message_count INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            conn.commit()
+        with closing(self._open_connection()) as conn:
+            with conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS simple_daily_count (
+                        date TEXT PRIMARY KEY,
+                        message_count INTEGER DEFAULT 0,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
     
     def get_today_string(self) -> str:
         """Get today's date as YYYY-MM-DD"""
-        return datetime.now().strftime('%Y-%m-%d')
+        # Reformat only once the clock passes the next local midnight
+        day_string, day_ends = self._today
+        if time.time() >= day_ends:
+            now = datetime.now()
+            tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+            day_string, day_ends = now.strftime('%Y-%m-%d'), tomorrow.timestamp()
+            self._today = (day_string, day_ends)
+        return day_string
     
-    def get_today_count(self) -> int:
-        """Get today's message count"""
-        today = self.get_today_string()
-        with sqlite3.connect(self.db_path) as conn:
+    def _read_count(self, date: str) -> int:
+        """Read a day's message count from SQLite"""
+        with self._reader() as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT message_count FROM simple_daily_count WHERE date = ?', (today,))
+            cursor.execute(_SELECT_COUNT, (date,))
             result = cursor.fetchone()
             return result[0] if result else 0
     
+    def _ensure_loaded(self, today: str) -> None:
+        """Hydrate the in-memory count on the first call of the day (caller holds _lock)"""
+        # pid too: gunicorn --preload forks workers from a parent that may hold a stale count
+        key = (today, os.getpid())
+        if self._loaded_key != key:
+            self._today_count = self._read_count(today)
+            self._loaded_key = key
+    
+    def get_today_count(self) -> int:
+        """Get today's message count"""
+        today = self.get_today_string()
+        with self._lock:
+            self._ensure_loaded(today)
+            return self._today_count
+    
     def can_send_message(self) -> dict:
         """Check if we can send another message today"""
+        # Once the limit is hit, every later check is answered with the same prebuilt dict
+        rejection = self._rejection
+        if rejection is not None and self._loaded_key == (self.get_today_string(), os.getpid()) \
+                and rejection['current_count'] == self._today_count:
+            return rejection
+        
         current_count = self.get_today_count()
         remaining = max(0, self.daily_limit - current_count)
         allowed = current_count < self.daily_limit
@@ -55,47 +169,121 @@ class SimpleDailyLimiter:
         if allowed:
             return {
                 'allowed': True,
-                'message': f'Message allowed. {remaining} messages remaining today.',
+                'message': self._allowed_messages[remaining],
                 'current_count': current_count,
                 'daily_limit': self.daily_limit,
                 'remaining': remaining
             }
         else:
-            return {
+            self._rejection = {
                 'allowed': False,
-                'message': f'Daily limit of {self.daily_limit} messages reached. Try again tomorrow!',
+                'message': self._limit_message,
                 'current_count': current_count,
                 'daily_limit': self.daily_limit,
                 'remaining': 0
             }
+            return self._rejection
     
     def record_message(self):
         """Record that a message was sent"""
         today = self.get_today_string()
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO simple_daily_count (date, message_count) VALUES (?, 1)
-                ON CONFLICT(date) DO UPDATE SET message_count = message_count + 1
-            ''', (today,))
-            conn.commit()
+        with self._lock:
+            self._ensure_loaded(today)
+            self._today_count += 1
+        self._ensure_writer()
+        self._write_queue.put(today)
+    
+    def _ensure_writer(self):
+        """Start this process's background writer if it isn't running"""
+        if self._writer_pid == os.getpid():
+            return
+        with self._lock:
+            if self._writer_pid == os.getpid():
+                return
+            self._writer_thread = threading.Thread(target=self._writer_loop, name="daily-count-writer", daemon=True)
+            self._writer_thread.start()
+            atexit.register(self.flush)
+            self._writer_pid = os.getpid()
+    
+    def _writer_loop(self):
+        """Persist queued message records in batches, one transaction per batch"""
+        # The only connection that writes; readers never wait on it
+        cursor = self._open_connection().cursor()
+        stopping = False
+        while not stopping:
+            item = self._write_queue.get()
+            if item is _STOP_WRITER:
+                break
+            batch = [item]
+            deadline = time.monotonic() + WRITE_BATCH_SECONDS
+            while len(batch) < WRITE_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._write_queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP_WRITER:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write_counts(cursor, Counter(batch))
+        cursor.connection.close()
+    
+    def _write_counts(self, cursor, counts: Counter):
+        """Add aggregated per-day message counts to SQLite in one transaction"""
+        try:
+            with cursor.connection:
+                cursor.executemany(_UPSERT_COUNT, counts.items())
+        except Exception as e:
+            print(f"❌ Failed to persist daily message count: {e}")
+    
+    def flush(self):
+        """Write any queued message records now (called at exit)"""
+        # Stop the writer first: a batch it is holding would otherwise die with the daemon thread
+        thread = self._writer_thread
+        if thread is not None and self._writer_pid == os.getpid() and thread.is_alive():
+            self._write_queue.put(_STOP_WRITER)
+            thread.join(WRITER_JOIN_SECONDS)
+            self._writer_pid = None
+        
+        counts = Counter()
+        while True:
+            try:
+                item = self._write_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP_WRITER:
+                counts[item] += 1
+        if counts:
+            with closing(self._open_connection()) as conn:
+                self._write_counts(conn.cursor(), counts)
+                # Leave planner statistics current for the next process, as SQLite advises before closing
+                conn.execute('PRAGMA optimize')
     
     def get_stats(self) -> dict:
         """Get simple stats for monitoring"""
         today = self.get_today_string()
-        current_count = self.get_today_count()
         
-        # Get recent daily usage
-        with sqlite3.connect(self.db_path) as conn:
+        # Get recent daily usage - the same rows seed today's count if this process hasn't loaded it
+        with self._reader() as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                SELECT date, message_count 
-                FROM simple_daily_count 
-                ORDER BY date DESC 
-                LIMIT 7
-            ''')
+            cursor.execute(_SELECT_RECENT_DAYS)
             recent_days = cursor.fetchall()
         
+        with self._lock:
+            key = (today, os.getpid())
+            if self._loaded_key != key:
+                self._today_count = next((count for date, count in recent_days if date == today), 0)
+                self._loaded_key = key
+            current_count = self._today_count
+        
+        # Today's row comes from memory so it includes messages the writer hasn't flushed yet
+        recent_days = [row for row in recent_days if row[0] != today]
+        if current_count:
+            recent_days = [(today, current_count)] + recent_days[:6]
+        
         return {
             'today': {
                 'date': today,
@@ -105,12 +293,14 @@ class SimpleDailyLimiter:
                 'limit_reached': current_count >= self.daily_limit
             },
             'recent_days': [
-                {'date': row[0], 'messages': row[1]} 
-                for row in recent_days
+                {'date': date, 'messages': count} 
+                for date, count in recent_days
             ]
         }
 
     def update_limit(self, new_limit: int):
         """Update the daily limit"""
         self.daily_limit = new_limit
+        self._build_messages()
+        self._rejection = None
         print(f"✅ Daily limit updated to {new_limit} messages")
\ No newline at end of file
@@ -3,13 +3,270 @@ CSA Shag Archive Data Query Tools
 Function calling tools for Claude to access real competition data
 """
 
+import hashlib
+import heapq
+import logging
+import numpy as np
 import pandas as pd
 import os
+from functools import lru_cache
+from itertools import combinations
 from pathlib import Path
 from response_formatter import MarkdownFormatter
 from chart_generator import chart_generator
 from data_protection import DataProtector, DataProtectionError
 
+logger = logging.getLogger(__name__)
+
+@lru_cache(maxsize=1)
+def _load_df(path, mtime):
+    """Load the archive once; the mtime in the key reloads it when the CSV changes"""
+    df = _read_parquet_snapshot(Path(path))
+    return df if df is not None else pd.read_csv(path, memory_map=True)
+
+def _read_parquet_snapshot(csv_path):
+    """Parquet copy of the CSV (scripts/build_parquet.py) with the CSV's dtypes, or None if missing/stale"""
+    parquet_path = csv_path.with_suffix('.parquet')
+    if not parquet_path.exists():
+        return None
+    try:
+        df = pd.read_parquet(parquet_path)
+    except Exception as e:
+        logger.warning("⚠️ Could not read Parquet snapshot, using CSV: %s", e)
+        return None
+    if df.attrs.get('source_csv_sha256') != hashlib.sha256(csv_path.read_bytes()).hexdigest():
+        return None
+    # The tools were written against read_csv's frame: categoricals would make groupby
+    # list empty groups, and missing strings must be NaN rather than None
+    text_columns = [col for col in df.columns if df[col].dtype == object or isinstance(df[col].dtype, pd.CategoricalDtype)]
+    df = df.astype({col: object for col in text_columns} | {col: 'int64' for col in df.select_dtypes('integer').columns})
+    df[text_columns] = df[text_columns].fillna(np.nan)
+    return df
+
+def archive_csv_path():
+    """The archive CSV the tools read: the repo's data directory, else the container's /app/data"""
+    csv_path = Path(__file__).parent.parent / "data" / "Shaggy_Shag_Archives_Final.csv"
+    if not csv_path.exists():
+        # Fallback for different deployment structures
+        csv_path = Path("/app/data/Shaggy_Shag_Archives_Final.csv")
+    return csv_path
+
+def archive_version():
+    """(path, mtime) of the archive CSV - the token the tool caches are keyed on - or None if missing"""
+    csv_path = archive_csv_path()
+    try:
+        return (str(csv_path), csv_path.stat().st_mtime)
+    except OSError:
+        return None
+
+def load_archive(csv_path):
+    """Cached archive DataFrame - read-only, callers filter by rebinding, never in place"""
+    return _load_df(str(csv_path), csv_path.stat().st_mtime)
+
+# Equality filters answered from prebuilt indexes: (filter key, column, log label)
+INDEXED_FILTERS = [
+    ('division', 'Division', "🎯 Division"),
+    ('organization', 'Organization', "🏢 Organization"),
+    ('placement', 'Placement', "🏆 Placement"),
+    ('male_name', 'Male Name', "👨 Male name"),
+    ('female_name', 'Female Name', "👩 Female name"),
+    ('year', 'Year', "📅 Year"),
+]
+_NO_ROWS = np.array([], dtype=np.intp)
+
+@lru_cache(maxsize=1)
+def _column_indexes(path, mtime):
+    """value -> sorted row positions, per indexed column of the cached archive"""
+    df = _load_df(path, mtime)
+    return {column: df.groupby(column, sort=False).indices for _, column, _ in INDEXED_FILTERS}
+
+def archive_indexes(csv_path):
+    """Per-column row indexes for the frame load_archive returns"""
+    return _column_indexes(str(csv_path), csv_path.stat().st_mtime)
+
+@lru_cache(maxsize=1)
+def _participant_index(path, mtime):
+    """name -> sorted archive positions where the name danced either part"""
+    indexes = _column_indexes(path, mtime)
+    participants = dict(indexes['Male Name'])
+    for name, positions in indexes['Female Name'].items():
+        male_positions = participants.get(name)
+        participants[name] = positions if male_positions is None else np.union1d(male_positions, positions)
+    return participants
+
+def participant_positions(csv_path, name):
+    """Sorted archive positions where Male Name or Female Name equals name"""
+    return _participant_index(str(csv_path), csv_path.stat().st_mtime).get(name, _NO_ROWS)
+
+def participant_rows(csv_path, rows_df, name):
+    """Rows of rows_df (a row subset of load_archive's frame, in archive order) where name danced either part"""
+    positions = participant_positions(csv_path, name)
+    subset = rows_df.index.to_numpy()
+    if len(subset) == len(load_archive(csv_path)):
+        return rows_df.take(positions)
+    # Locate the name's positions inside the subset with binary searches, keeping the ones present
+    found = np.searchsorted(subset, positions)
+    present = found < len(subset)
+    found = found[present]
+    return rows_df.take(found[subset[found] == positions[present]])
+
+@lru_cache(maxsize=1)
+def _year_order(path, mtime):
+    """(row positions in stable Year order, the Year values in that order) for range lookups"""
+    years = _load_df(path, mtime)['Year'].to_numpy()
+    order = np.argsort(years, kind='stable')
+    return order, years[order]
+
+def year_range_rows(csv_path, start_year, end_year):
+    """Sorted archive positions with start_year <= Year <= end_year, via two binary searches"""
+    order, sorted_years = _year_order(str(csv_path), csv_path.stat().st_mtime)
+    lo = np.searchsorted(sorted_years, start_year, side='left')
+    hi = np.searchsorted(sorted_years, end_year, side='right')
+    return np.sort(order[lo:hi])
+
+@lru_cache(maxsize=8)
+def _factorized(path, mtime, column):
+    """(per-row code, distinct values, lowercased distinct values) for a text column of the archive"""
+    codes, values = pd.factorize(_load_df(path, mtime)[column], use_na_sentinel=False)
+    lowered = [value.lower() if isinstance(value, str) else None for value in values]
+    return codes, values, lowered
+
+def archive_factorized(csv_path, column):
+    """Factorized column of the frame load_archive returns - substring searches run per distinct value"""
+    return _factorized(str(csv_path), csv_path.stat().st_mtime, column)
+
+@lru_cache(maxsize=1)
+def _win_flags(path, mtime):
+    """int8 per archive row: 1 where Placement == 1"""
+    return (_load_df(path, mtime)['Placement'].to_numpy() == 1).astype(np.int8)
+
+def count_row_wins(csv_path, rows_df):
+    """Wins among rows_df, a row subset of load_archive's frame (its labels are archive positions)"""
+    return int(_win_flags(str(csv_path), csv_path.stat().st_mtime)[rows_df.index.to_numpy()].sum())
+
+@lru_cache(maxsize=8)
+def _stacked_codes(path, mtime, columns):
+    """Columns factorized together: (codes shaped (columns, rows), distinct values, per-value missing flag)"""
+    df = _load_df(path, mtime)
+    codes, values = pd.factorize(np.concatenate([df[col].to_numpy() for col in columns]), use_na_sentinel=False)
+    missing = np.array([not isinstance(value, str) for value in values], dtype=bool)
+    return codes.reshape(len(columns), -1), values, missing
+
+def top_value_counts(csv_path, rows_df, columns, n):
+    """Non-null values of one column (or several, stacked column by column) counted like value_counts().head(n)
+
+    rows_df must be a row subset of load_archive's frame (its RangeIndex labels are archive positions).
+    Counting runs on integer codes numbered in first-appearance order, so ties rank exactly as
+    value_counts ranks the strings themselves.
+    """
+    columns = (columns,) if isinstance(columns, str) else tuple(columns)
+    codes, values, missing = _stacked_codes(str(csv_path), csv_path.stat().st_mtime, columns)
+    row_codes = codes[:, rows_df.index.to_numpy()].ravel()
+    row_codes = row_codes[~missing[row_codes]]
+    counts = pd.Series(row_codes).value_counts().head(n)
+    return pd.Series(counts.to_numpy(), index=values[counts.index.to_numpy()], name='count')
+
+JUDGE_COLUMNS = ('Judge 1', 'Judge 2', 'Judge 3', 'Judge 4', 'Judge 5')
+# The 10 (i, j) column pairs of a sorted 5-judge panel, in combinations() order
+_PANEL_FIRST, _PANEL_SECOND = (np.array(side) for side in zip(*combinations(range(len(JUDGE_COLUMNS)), 2)))
+
+@lru_cache(maxsize=1)
+def _judge_columns_present(path, mtime):
+    """The JUDGE_COLUMNS the archive actually has"""
+    columns = _load_df(path, mtime).columns
+    return tuple(col for col in JUDGE_COLUMNS if col in columns)
+
+def archive_judge_columns(csv_path):
+    """Judge columns present in the frame load_archive returns"""
+    return _judge_columns_present(str(csv_path), csv_path.stat().st_mtime)
+
+@lru_cache(maxsize=1)
+def _judge_ranks(path, mtime):
+    """(rank in sorted name order per stacked judge code - missing judges rank last, names in that order)"""
+    _, values, missing = _stacked_codes(path, mtime, JUDGE_COLUMNS)
+    present = np.flatnonzero(~missing)
+    by_name = present[np.argsort(values[present], kind='stable')]
+    ranks = np.full(len(values), len(by_name), dtype=np.int64)
+    ranks[by_name] = np.arange(len(by_name))
+    return ranks, values[by_name]
+
+@lru_cache(maxsize=1)
+def _judge_codes(path, mtime):
+    """judge name -> its code in the stacked judge columns"""
+    _, values, missing = _stacked_codes(path, mtime, JUDGE_COLUMNS)
+    return {value: code for code, value in enumerate(values) if not missing[code]}
+
+def judged_by_mask(csv_path, rows_df, judge_name):
+    """Boolean mask over rows_df (a row subset of load_archive's frame): True where judge_name sat on the panel"""
+    path, mtime = str(csv_path), csv_path.stat().st_mtime
+    code = _judge_codes(path, mtime).get(judge_name)
+    if code is None:
+        return np.zeros(len(rows_df), dtype=bool)
+    codes, _, _ = _stacked_codes(path, mtime, JUDGE_COLUMNS)
+    return (codes[:, rows_df.index.to_numpy()] == code).any(axis=0)
+
+def judge_pair_counts(csv_path, rows_df):
+    """Judge pairs sharing a panel in rows_df, counted like value_counts over each row's combinations(sorted(judges), 2)
+
+    rows_df must be a row subset of load_archive's frame. Returns counts indexed by (judge_1, judge_2).
+    """
+    path, mtime = str(csv_path), csv_path.stat().st_mtime
+    codes, _, _ = _stacked_codes(path, mtime, JUDGE_COLUMNS)
+    ranks, names = _judge_ranks(path, mtime)
+    # Each row's judges in name order, missing ones pushed to the end
+    panels = np.sort(ranks[codes[:, rows_df.index.to_numpy()]].T, axis=1)
+    first, second = panels[:, _PANEL_FIRST].ravel(), panels[:, _PANEL_SECOND].ravel()
+    # Row-major ravel keeps the loop's pair order; a pair is real when its later judge is present
+    present = second < len(names)
+    pair_codes, pairs = pd.factorize(first[present] * (len(names) + 1) + second[present])
+    counts = pd.Series(pair_codes).value_counts()
+    pairs = pairs[counts.index.to_numpy()]
+    index = pd.MultiIndex.from_arrays([names[pairs // (len(names) + 1)], names[pairs % (len(names) + 1)]])
+    return pd.Series(counts.to_numpy(), index=index, name='count')
+
+def dancer_filter_mask(dancer_df, filters, default_end_year=None):
+    """One boolean mask for the organization/division/year-range filters on a dancer's rows
+
+    start_year bounds the range; end_year falls back to default_end_year (None = no upper bound).
+    """
+    mask = np.ones(len(dancer_df), dtype=bool)
+    organization = filters.get('organization')
+    if organization and organization != 'Both':
+        mask &= dancer_df['Organization'].to_numpy() == organization
+    if filters.get('division'):
+        mask &= dancer_df['Division'].to_numpy() == filters['division']
+    if filters.get('start_year'):
+        years = dancer_df['Year'].to_numpy()
+        mask &= years >= filters['start_year']
+        end_year = filters.get('end_year', default_end_year)
+        if end_year is not None:
+            mask &= years <= end_year
+    return mask
+
+def division_people(rows_df, divisions):
+    """Long frame of (name, Division, Year), one row per dancer per entry in the given divisions"""
+    in_divisions = rows_df['Division'].isin(divisions).to_numpy()
+    return pd.DataFrame({
+        'name': np.concatenate([rows_df['Male Name'].to_numpy()[in_divisions], rows_df['Female Name'].to_numpy()[in_divisions]]),
+        'Division': np.tile(rows_df['Division'].to_numpy()[in_divisions], 2),
+        'Year': np.tile(rows_df['Year'].to_numpy()[in_divisions], 2)
+    }).dropna(subset=['name'])
+
+def division_dancers(rows_df, divisions):
+    """{division: array of the distinct names dancing either part in it} for the given divisions, from one grouped pass"""
+    by_division = division_people(rows_df, divisions).groupby('Division', sort=False)['name'].unique()
+    return {division: by_division.get(division, np.array([], dtype=object)) for division in divisions}
+
+def contains_mask(lowered, text):
+    """Case-insensitive literal substring match over lowercased values (missing values never match)"""
+    needle = text.lower()
+    return np.fromiter((value is not None and needle in value for value in lowered), dtype=bool, count=len(lowered))
+
+def frame_records(frame):
+    """Same as frame.to_dict('records'), built column-wise from native Python lists"""
+    columns = list(frame.columns)
+    return [dict(zip(columns, row)) for row in zip(*(frame[col].tolist() for col in columns))]
+
 # Tool definition for Claude function calling
 TOOLS = [
     {
@@ -152,17 +409,12 @@ def execute_query_csa_data(query_type, filters, limit=100):
     
     # SECURITY: Enforce absolute maximum limit
     if limit > 50:
+        logger.info("🔒 SECURITY: Limit capped at 50 (was %s)", limit)
         limit = 50
-        print(f"🔒 SECURITY: Limit capped at 50 (was {limit})")
     
     try:
         # Load the CSV data - handle both development and production paths
-        current_dir = Path(__file__).parent
-        csv_path = current_dir.parent / "data" / "Shaggy_Shag_Archives_Final.csv"
-        
-        if not csv_path.exists():
-            # Fallback for different deployment structures
-            csv_path = Path("/app/data/Shaggy_Shag_Archives_Final.csv")
+        csv_path = archive_csv_path()
         
         if not csv_path.exists():
             return {
@@ -171,50 +423,46 @@ def execute_query_csa_data(query_type, filters, limit=100):
                 "filters": filters
             }
         
-        print(f"🔍 Loading CSV from: {csv_path}")
-        df = pd.read_csv(csv_path)
-        print(f"📊 Loaded {len(df)} total records")
-        
-        # Apply filters
-        filtered_df = df.copy()
-        original_count = len(filtered_df)
-        
-        # Apply each filter
-        if 'division' in filters and filters['division']:
-            filtered_df = filtered_df[filtered_df['Division'] == filters['division']]
-            print(f"🎯 Division filter '{filters['division']}': {len(filtered_df)} records")
+        logger.debug("🔍 Loading CSV from: %s", csv_path)
+        df = load_archive(csv_path)
+        logger.debug("📊 Loaded %d total records", len(df))
         
-        if 'organization' in filters and filters['organization'] and filters['organization'] != 'Both':
-            filtered_df = filtered_df[filtered_df['Organization'] == filters['organization']]
-            print(f"🏢 Organization filter '{filters['organization']}': {len(filtered_df)} records")
+        original_count = len(df)
         
-        if 'placement' in filters and filters['placement'] is not None:
-            filtered_df = filtered_df[filtered_df['Placement'] == filters['placement']]
-            print(f"🏆 Placement filter '{filters['placement']}': {len(filtered_df)} records")
+        # Apply each equality filter by intersecting index row sets; only the result is materialized
+        indexes = archive_indexes(csv_path)
+        rows = None  # None = no filter applied yet
+        for key, column, label in INDEXED_FILTERS:
+            value = filters.get(key)
+            if key == 'placement':
+                if value is None:
+                    continue
+            elif not value or (key == 'organization' and value == 'Both'):
+                continue
+            matches = indexes[column].get(value, _NO_ROWS)
+            rows = matches if rows is None else np.intersect1d(rows, matches, assume_unique=True)
+            logger.debug("%s filter '%s': %d records", label, value, len(rows))
         
-        if 'male_name' in filters and filters['male_name']:
-            filtered_df = filtered_df[filtered_df['Male Name'] == filters['male_name']]
-            print(f"👨 Male name filter '{filters['male_name']}': {len(filtered_df)} records")
-        
-        if 'female_name' in filters and filters['female_name']:
-            filtered_df = filtered_df[filtered_df['Female Name'] == filters['female_name']]
-            print(f"👩 Female name filter '{filters['female_name']}': {len(filtered_df)} records")
-        
-        if 'year' in filters and filters['year']:
-            filtered_df = filtered_df[filtered_df['Year'] == filters['year']]
-            print(f"📅 Year filter '{filters['year']}': {len(filtered_df)} records")
-        
-        # Year range filtering (for queries like "last 10 years")
+        # Year range filtering (for queries like "last 10 years") - a slice of the Year-sorted positions
         if 'start_year' in filters and 'end_year' in filters and filters['start_year'] and filters['end_year']:
-            filtered_df = filtered_df[
-                (filtered_df['Year'] >= filters['start_year']) & 
-                (filtered_df['Year'] <= filters['end_year'])
-            ]
-            print(f"📅 Year range filter {filters['start_year']}-{filters['end_year']}: {len(filtered_df)} records")
+            matches = year_range_rows(csv_path, filters['start_year'], filters['end_year'])
+            rows = matches if rows is None else np.intersect1d(rows, matches, assume_unique=True)
+            logger.debug("📅 Year range filter %s-%s: %d records", filters['start_year'], filters['end_year'], len(rows))
+        filtered_df = df if rows is None else df.take(rows)
+        
+        # Remaining filters combine NumPy masks and select once
+        mask = None
         
         if 'contest' in filters and filters['contest']:
-            filtered_df = filtered_df[filtered_df['Contest'].str.contains(filters['contest'], case=False, na=False)]
-            print(f"🏆 Contest filter '{filters['contest']}': {len(filtered_df)} records")
+            # Match the ~200 distinct contest names, then look rows up by code
+            codes, _, lowered = archive_factorized(csv_path, 'Contest')
+            contest_mask = contains_mask(lowered, filters['contest'])[codes if rows is None else codes[rows]]
+            mask = contest_mask if mask is None else mask & contest_mask
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("🏆 Contest filter '%s': %d records", filters['contest'], mask.sum())
+        
+        if mask is not None:
+            filtered_df = filtered_df[mask]
         
         # Ensure limit is reasonable
         limit = min(limit, 50)
@@ -236,8 +484,8 @@ def execute_query_csa_data(query_type, filters, limit=100):
                 result["message"] = f"No records found matching the filters"
             elif gender == 'both':
                 # Show both male and female dancers
-                male_counts = filtered_df['Male Name'].value_counts().head(limit // 2)
-                female_counts = filtered_df['Female Name'].value_counts().head(limit // 2)
+                male_counts = top_value_counts(csv_path, filtered_df, 'Male Name', limit // 2)
+                female_counts = top_value_counts(csv_path, filtered_df, 'Female Name', limit // 2)
 
                 male_list = [{"name": name, "count": int(count), "gender": "male"} for name, count in male_counts.items()]
                 female_list = [{"name": name, "count": int(count), "gender": "female"} for name, count in female_counts.items()]
@@ -286,7 +534,7 @@ def execute_query_csa_data(query_type, filters, limit=100):
             else:
                 # Single gender query
                 name_column = 'Male Name' if gender == 'male' else 'Female Name'
-                counts = filtered_df[name_column].value_counts().head(limit)
+                counts = top_value_counts(csv_path, filtered_df, name_column, limit)
 
                 # Raw results for backward compatibility
                 results_list = [
@@ -327,7 +575,7 @@ def execute_query_csa_data(query_type, filters, limit=100):
                 result["message"] = "No records found for this dancer with the specified filters"
             else:
                 records = filtered_df[['Contest', 'Year', 'Division', 'Organization', 'Placement', 'Male Name', 'Female Name', 'Host Club']].head(limit)
-                result["records"] = records.to_dict('records')
+                result["records"] = frame_records(records)
                 result["message"] = f"Found {len(filtered_df)} total records, showing first {min(len(records), limit)}"
         
         elif query_type == "dancer_search":
@@ -337,9 +585,11 @@ def execute_query_csa_data(query_type, filters, limit=100):
                 result["error"] = "dancer_name is required for dancer_search"
                 return result
             
-            # Search in both Male Name and Female Name columns
-            male_matches = df[df['Male Name'].str.contains(search_name, case=False, na=False)]['Male Name'].unique()
-            female_matches = df[df['Female Name'].str.contains(search_name, case=False, na=False)]['Female Name'].unique()
+            # Search the distinct names in both Male Name and Female Name columns
+            _, male_names, male_lower = archive_factorized(csv_path, 'Male Name')
+            _, female_names, female_lower = archive_factorized(csv_path, 'Female Name')
+            male_matches = male_names[contains_mask(male_lower, search_name)]
+            female_matches = female_names[contains_mask(female_lower, search_name)]
             
             all_matches = list(set(list(male_matches) + list(female_matches)))
             all_matches.sort()
@@ -351,22 +601,13 @@ def execute_query_csa_data(query_type, filters, limit=100):
             elif len(all_matches) == 1:
                 # Exact match found - return their competition summary
                 exact_name = all_matches[0]
-                dancer_df = df[(df['Male Name'] == exact_name) | (df['Female Name'] == exact_name)]
+                dancer_df = df.take(participant_positions(csv_path, exact_name))
                 
                 # Apply any additional filters
-                for filter_key, filter_value in filters.items():
-                    if filter_key == 'dancer_name':
-                        continue
-                    if filter_key == 'organization' and filter_value and filter_value != 'Both':
-                        dancer_df = dancer_df[dancer_df['Organization'] == filter_value]
-                    elif filter_key == 'division' and filter_value:
-                        dancer_df = dancer_df[dancer_df['Division'] == filter_value]
-                    elif filter_key == 'start_year' and filter_value:
-                        end_year = filters.get('end_year', 2024)
-                        dancer_df = dancer_df[(dancer_df['Year'] >= filter_value) & (dancer_df['Year'] <= end_year)]
+                dancer_df = dancer_df[dancer_filter_mask(dancer_df, filters, default_end_year=2024)]
                 
                 total_contests = len(dancer_df)
-                wins = len(dancer_df[dancer_df['Placement'] == 1])
+                wins = count_row_wins(csv_path, dancer_df)
                 divisions = dancer_df['Division'].unique().tolist()
                 years = f"{dancer_df['Year'].min()}-{dancer_df['Year'].max()}"
                 
@@ -391,39 +632,33 @@ def execute_query_csa_data(query_type, filters, limit=100):
                 result["message"] = "No contest results found matching the filters"
             else:
                 records = filtered_df[['Contest', 'Year', 'Division', 'Placement', 'Male Name', 'Female Name', 'Organization']].head(limit)
-                result["records"] = records.to_dict('records')
+                result["records"] = frame_records(records)
                 result["message"] = f"Found {len(filtered_df)} contest results, showing first {min(len(records), limit)}"
         
         elif query_type == "judge_statistics":
-            # Count judges across all 5 judge columns
-            judge_columns = ['Judge 1', 'Judge 2', 'Judge 3', 'Judge 4', 'Judge 5']
-            
-            # Check if judge columns exist in the data
-            available_judge_columns = [col for col in judge_columns if col in filtered_df.columns]
+            # Count judges across all 5 judge columns (those the archive has, resolved once per load)
+            available_judge_columns = archive_judge_columns(csv_path)
             
             if not available_judge_columns:
                 result["results"] = []
                 result["message"] = "No judge columns found in the database"
                 result["note"] = "Judge data may not be available for this dataset"
             else:
-                # Combine all judge columns into one series
-                all_judges_list = []
-                for col in available_judge_columns:
-                    judges_in_col = filtered_df[col].dropna()
-                    all_judges_list.extend(judges_in_col.tolist())
+                # Count judge occurrences across all judge columns, on integer codes
+                judge_counts = top_value_counts(csv_path, filtered_df, available_judge_columns, limit)
                 
-                if not all_judges_list:
+                if judge_counts.empty:
                     result["results"] = []
                     result["message"] = "No judge data found in the filtered records"
                     result["records_with_judge_data"] = 0
                     result["records_without_judge_data"] = len(filtered_df)
                 else:
-                    # Count judge occurrences
-                    judge_series = pd.Series(all_judges_list)
-                    judge_counts = judge_series.value_counts().head(limit)
-
                     # Calculate statistics about judge data completeness
-                    records_with_judges = filtered_df[available_judge_columns].notna().any(axis=1).sum()
+                    # (a judge seat is filled when its stacked code isn't a missing value)
+                    judge_codes, _, judge_missing = _stacked_codes(str(csv_path), csv_path.stat().st_mtime, available_judge_columns)
+                    records_with_judges = int(np.count_nonzero(
+                        (~judge_missing[judge_codes[:, filtered_df.index.to_numpy()]]).any(axis=0)
+                    ))
                     records_without_judges = len(filtered_df) - records_with_judges
 
                     # Raw results for backward compatibility
@@ -469,7 +704,7 @@ def execute_query_csa_data(query_type, filters, limit=100):
                 result["message"] = "No records found matching the custom filters"
             else:
                 sample = filtered_df.head(limit)
-                result["sample_records"] = sample.to_dict('records')
+                result["sample_records"] = frame_records(sample)
                 result["message"] = f"Custom query returned {len(filtered_df)} records, showing first {min(len(sample), limit)}"
         
         # ========== SMART DANCER LOOKUP (PREVENTS MULTI-TURN CONVERSATIONS) ==========
@@ -481,27 +716,27 @@ def execute_query_csa_data(query_type, filters, limit=100):
                 return result
             
             # Comprehensive search that handles all cases in ONE call
-            print(f"🔍 Smart lookup for '{search_name}'")
+            logger.debug("🔍 Smart lookup for '%s'", search_name)
             
-            # 1. Try exact matches in both gender columns
-            exact_male_df = df[df['Male Name'] == search_name]
-            exact_female_df = df[df['Female Name'] == search_name]
-            exact_combined_df = pd.concat([exact_male_df, exact_female_df]).drop_duplicates()
+            # 1. Try exact matches in both gender columns - one participant index lookup, one take
+            exact_rows = participant_positions(csv_path, search_name)
             
-            if len(exact_combined_df) > 0:
-                print(f"✅ Found exact match: {len(exact_combined_df)} records")
-                dancer_df = exact_combined_df
+            if len(exact_rows) > 0:
+                logger.debug("✅ Found exact match: %d records", len(exact_rows))
+                dancer_df = df.take(exact_rows)
             else:
-                # 2. Try partial matches
-                partial_male_df = df[df['Male Name'].str.contains(search_name, case=False, na=False)]
-                partial_female_df = df[df['Female Name'].str.contains(search_name, case=False, na=False)]
-                partial_combined_df = pd.concat([partial_male_df, partial_female_df]).drop_duplicates()
+                # 2. Try partial matches against the distinct names, then map to rows by code
+                male_codes, male_names, male_lower = archive_factorized(csv_path, 'Male Name')
+                female_codes, female_names, female_lower = archive_factorized(csv_path, 'Female Name')
+                male_hits = contains_mask(male_lower, search_name)
+                female_hits = contains_mask(female_lower, search_name)
+                partial_count = np.count_nonzero(male_hits[male_codes] | female_hits[female_codes])
                 
-                if len(partial_combined_df) > 0:
-                    print(f"🔍 Using partial match: {len(partial_combined_df)} records")
+                if partial_count > 0:
+                    logger.debug("🔍 Using partial match: %d records", partial_count)
                     # Get unique name matches for user feedback
-                    male_matches = partial_male_df['Male Name'].unique()
-                    female_matches = partial_female_df['Female Name'].unique()
+                    male_matches = male_names[male_hits]
+                    female_matches = female_names[female_hits]
                     all_matches = list(set(list(male_matches) + list(female_matches)))
                     
                     result["possible_matches"] = all_matches[:10]  # Limit for readability
@@ -511,33 +746,33 @@ def execute_query_csa_data(query_type, filters, limit=100):
                     result["message"] = f"No dancers found matching '{search_name}' in any form."
                     return result
             
-            # Apply additional filters
-            if 'organization' in filters and filters['organization'] and filters['organization'] != 'Both':
-                dancer_df = dancer_df[dancer_df['Organization'] == filters['organization']]
-            
-            if 'division' in filters and filters['division']:
-                dancer_df = dancer_df[dancer_df['Division'] == filters['division']]
-            
-            if 'start_year' in filters and filters['start_year']:
-                end_year = filters.get('end_year', dancer_df['Year'].max())
-                dancer_df = dancer_df[(dancer_df['Year'] >= filters['start_year']) & 
-                                    (dancer_df['Year'] <= end_year)]
+            # Apply additional filters (no end_year = through the dancer's latest year);
+            # unfiltered lookups keep the exact-match rows without another copy
+            keep = dancer_filter_mask(dancer_df, filters)
+            if not keep.all():
+                dancer_df = dancer_df[keep]
             
             # Return comprehensive summary to prevent follow-up queries
             total_contests = len(dancer_df)
-            total_wins = len(dancer_df[dancer_df['Placement'] == 1])
+            positions = dancer_df.index.to_numpy()
+            is_win = _win_flags(str(csv_path), csv_path.stat().st_mtime)[positions]
+            total_wins = int(is_win.sum())
             
-            # Division breakdown
-            division_summary = {}
-            for div in dancer_df['Division'].unique():
-                div_df = dancer_df[dancer_df['Division'] == div]
-                div_wins = len(div_df[div_df['Placement'] == 1])
-                division_summary[div] = {"contests": len(div_df), "wins": div_wins}
+            # Division breakdown: bincount over the cached Division codes, in first-appearance order
+            div_codes, div_names, _ = archive_factorized(csv_path, 'Division')
+            row_divs = div_codes[positions]
+            div_contests = np.bincount(row_divs, minlength=len(div_names))
+            div_wins = np.bincount(row_divs, weights=is_win, minlength=len(div_names))
+            division_summary = {
+                div_names[code]: {"contests": int(div_contests[code]), "wins": int(div_wins[code])}
+                for code in pd.unique(row_divs)
+            }
             
             # Career span
             if total_contests > 0:
-                career_start = int(dancer_df['Year'].min())
-                career_end = int(dancer_df['Year'].max())
+                years = dancer_df['Year'].to_numpy()
+                career_start = int(years.min())
+                career_end = int(years.max())
                 career_span = f"{career_start}-{career_end}" if career_start != career_end else str(career_start)
             else:
                 career_span = "No data"
@@ -558,16 +793,18 @@ def execute_query_csa_data(query_type, filters, limit=100):
 """
 
             # Create division breakdown table
-            div_data = [
-                {
-                    "Division": div,
-                    "Contests": stats["contests"],
-                    "Wins": stats["wins"],
-                    "Win Rate": f"{(stats['wins']/stats['contests']*100):.1f}%" if stats['contests'] > 0 else "0%"
-                }
+            div_rows = (
+                (
+                    div,
+                    stats["contests"],
+                    stats["wins"],
+                    f"{(stats['wins']/stats['contests']*100):.1f}%" if stats['contests'] > 0 else "0%"
+                )
                 for div, stats in division_summary.items()
-            ]
-            division_table = MarkdownFormatter.create_table(div_data, max_rows=10)
+            )
+            division_table = MarkdownFormatter.create_table_from_rows(
+                div_rows, ["Division", "Contests", "Wins", "Win Rate"], max_rows=10
+            )
 
             # Determine if user applied specific filters (beyond just name)
             has_filters = any([
@@ -581,9 +818,9 @@ def execute_query_csa_data(query_type, filters, limit=100):
             max_contests = min(100, limit) if has_filters else 20
 
             # Get contests sorted by year (most recent first)
-            contest_list = dancer_df.nlargest(max_contests, 'Year')[
+            contest_list = frame_records(dancer_df.nlargest(max_contests, 'Year')[
                 ['Contest', 'Year', 'Division', 'Placement', 'Organization']
-            ].to_dict('records')
+            ])
 
             # Apply protection limit
             if has_filters:
@@ -680,17 +917,16 @@ def execute_query_csa_data(query_type, filters, limit=100):
                 return {"error": "dancer_name is required for win_statistics"}
             
             # Get dancer's records
-            dancer_df = filtered_df[
-                (filtered_df['Male Name'] == dancer_name) | 
-                (filtered_df['Female Name'] == dancer_name)
-            ]
+            dancer_df = participant_rows(csv_path, filtered_df, dancer_name)
             
             if len(dancer_df) == 0:
                 return {"error": f"No records found for {dancer_name}"}
             
-            total_contests = len(dancer_df)
-            wins = len(dancer_df[dancer_df['Placement'] == 1])
-            top_3 = len(dancer_df[dancer_df['Placement'] <= 3])
+            # Count straight off the Placement array - no intermediate frames
+            placements = dancer_df['Placement'].to_numpy()
+            total_contests = len(placements)
+            wins = int(np.count_nonzero(placements == 1))
+            top_3 = int(np.count_nonzero(placements <= 3))
             win_rate = (wins / total_contests * 100) if total_contests > 0 else 0
             
             return {
@@ -709,10 +945,7 @@ def execute_query_csa_data(query_type, filters, limit=100):
             if not dancer_name:
                 return {"error": "dancer_name is required for partnership_analysis"}
             
-            dancer_df = filtered_df[
-                (filtered_df['Male Name'] == dancer_name) | 
-                (filtered_df['Female Name'] == dancer_name)
-            ]
+            dancer_df = participant_rows(csv_path, filtered_df, dancer_name)
             
             if len(dancer_df) == 0:
                 return {"error": f"No records found for {dancer_name}"}
@@ -721,12 +954,11 @@ def execute_query_csa_data(query_type, filters, limit=100):
             is_male = (dancer_df['Male Name'] == dancer_name).any()
             partner_col = 'Female Name' if is_male else 'Male Name'
             
-            # Group by partner
+            # Group by partner in one pass (sort=False keeps first-appearance order)
+            partner_groups = (dancer_df['Placement'] == 1).groupby(dancer_df[partner_col], sort=False).agg(['size', 'sum'])
             partnership_stats = []
-            for partner in dancer_df[partner_col].dropna().unique():
-                partner_df = dancer_df[dancer_df[partner_col] == partner]
-                wins = len(partner_df[partner_df['Placement'] == 1])
-                contests = len(partner_df)
+            for partner, contests, wins in partner_groups.itertuples():
+                contests, wins = int(contests), int(wins)
                 
                 partnership_stats.append({
                     "partner": partner,
@@ -735,15 +967,15 @@ def execute_query_csa_data(query_type, filters, limit=100):
                     "win_rate": round(wins / contests * 100, 2) if contests > 0 else 0
                 })
             
-            # Sort by contests together (most partnerships first)
-            partnership_stats.sort(key=lambda x: x['contests_together'], reverse=True)
+            # Top partnerships by contests together - equal to a stable descending sort, cut at limit
+            top_partnerships = heapq.nlargest(limit, partnership_stats, key=lambda x: x['contests_together'])
             
             return {
                 "query": f"Partnership analysis for {dancer_name}",
                 "dancer": dancer_name,
                 "filters_applied": filters,
                 "total_partners": len(partnership_stats),
-                "partnerships": partnership_stats[:limit]
+                "partnerships": top_partnerships
             }
         
         # CAREER STATISTICS
@@ -752,18 +984,16 @@ def execute_query_csa_data(query_type, filters, limit=100):
             if not dancer_name:
                 return {"error": "dancer_name is required for career_statistics"}
             
-            dancer_df = filtered_df[
-                (filtered_df['Male Name'] == dancer_name) | 
-                (filtered_df['Female Name'] == dancer_name)
-            ]
+            dancer_df = participant_rows(csv_path, filtered_df, dancer_name)
             
             if len(dancer_df) == 0:
                 return {"error": f"No records found for {dancer_name}"}
             
-            first_year = dancer_df['Year'].min()
-            last_year = dancer_df['Year'].max()
+            years = dancer_df['Year'].to_numpy()
+            first_year = years.min()
+            last_year = years.max()
             years_active = last_year - first_year + 1
-            years_competed = dancer_df['Year'].nunique()
+            years_competed = len(np.unique(years))
             
             # Partners
             is_male = (dancer_df['Male Name'] == dancer_name).any()
@@ -812,7 +1042,7 @@ def execute_query_csa_data(query_type, filters, limit=100):
         return result
     
     except Exception as e:
-        print(f"🔥 QUERY ERROR: {type(e).__name__}: {str(e)}")
+        logger.error("🔥 QUERY ERROR: %s: %s", type(e).__name__, e)
         return {
             "error": f"Query execution failed: {type(e).__name__}: {str(e)}",
             "query_type": query_type,
@@ -826,40 +1056,42 @@ def execute_analyze_csa_data(analysis_type, filters={}, limit=100):
     """
     try:
         # Load CSV
-        current_dir = Path(__file__).parent
-        csv_path = current_dir.parent / "data" / "Shaggy_Shag_Archives_Final.csv"
-
-        if not csv_path.exists():
-            csv_path = Path("/app/data/Shaggy_Shag_Archives_Final.csv")
+        csv_path = archive_csv_path()
 
         if not csv_path.exists():
             return {"error": f"Database not found at {csv_path}"}
 
-        df = pd.read_csv(csv_path)
+        df = load_archive(csv_path)
 
-        # Apply base filters
+        # Apply base filters as one combined NumPy mask, selected once;
+        # with no active filter the cached frame is used as-is
+        masks = []
         if filters.get('organization') and filters['organization'] != 'Both':
-            df = df[df['Organization'] == filters['organization']]
+            masks.append(df['Organization'].to_numpy() == filters['organization'])
 
         if filters.get('division'):
-            df = df[df['Division'] == filters['division']]
+            masks.append(df['Division'].to_numpy() == filters['division'])
 
         if filters.get('start_year') and filters.get('end_year'):
-            df = df[(df['Year'] >= filters['start_year']) & (df['Year'] <= filters['end_year'])]
+            years = df['Year'].to_numpy()
+            masks.append((years >= filters['start_year']) & (years <= filters['end_year']))
+
+        if masks:
+            df = df[np.logical_and.reduce(masks)]
 
         # Route to analysis functions
         if analysis_type == "yearly_active_dancers":
-            yearly = df.groupby('Year').agg({
-                'Male Name': pd.Series.nunique,
-                'Female Name': pd.Series.nunique
-            }).rename(columns={'Male Name': 'Male', 'Female Name': 'Female'})
+            yearly = df.groupby('Year').agg(Male=('Male Name', 'nunique'), Female=('Female Name', 'nunique'))
             yearly['Total'] = yearly['Male'] + yearly['Female']
             yearly['Change'] = yearly['Total'].diff().fillna(0)
 
-            yearly_list = yearly.reset_index().to_dict('records')
+            yearly_rows = yearly.reset_index()
+            yearly_list = yearly_rows.to_dict('records')
 
             # Create rich markdown table
-            table_md = MarkdownFormatter.create_table(yearly_list, max_rows=100)
+            table_md = MarkdownFormatter.create_table_from_rows(
+                yearly_rows.itertuples(index=False, name=None), list(yearly_rows.columns), max_rows=100
+            )
 
             # Create trend chart
             chart_url = chart_generator.create_trend_chart_with_change(
@@ -897,22 +1129,17 @@ def execute_analyze_csa_data(analysis_type, filters={}, limit=100):
                 return {"error": "judge_name required for this analysis"}
 
             # Find contests where this judge participated
-            judge_mask = (
-                (df['Judge 1'] == judge_name) |
-                (df['Judge 2'] == judge_name) |
-                (df['Judge 3'] == judge_name) |
-                (df['Judge 4'] == judge_name) |
-                (df['Judge 5'] == judge_name)
-            )
-            judge_contests = df[judge_mask]
+            judge_contests = df[judged_by_mask(csv_path, df, judge_name)]
 
-            # Count male dancers
-            male_counts = judge_contests['Male Name'].value_counts().head(limit)
+            # Count male dancers, and their wins in the same contests with one grouped sum
+            male_counts = top_value_counts(csv_path, judge_contests, 'Male Name', limit)
+            judged_wins = pd.Series(
+                _win_flags(str(csv_path), csv_path.stat().st_mtime)[judge_contests.index.to_numpy()]
+            ).groupby(judge_contests['Male Name'].to_numpy(), sort=False).sum()
 
             results = []
             for dancer, count in male_counts.items():
-                dancer_with_judge = judge_contests[judge_contests['Male Name'] == dancer]
-                wins = len(dancer_with_judge[dancer_with_judge['Placement'] == 1])
+                wins = int(judged_wins[dancer])
                 win_rate = (wins / count * 100) if count > 0 else 0
 
                 results.append({
@@ -965,23 +1192,10 @@ def execute_analyze_csa_data(analysis_type, filters={}, limit=100):
             }
 
         elif analysis_type == "judge_panel_combinations":
-            from itertools import combinations
-
             min_occ = filters.get('min_occurrences', 5)
-            panels = []
-
-            for _, row in df.iterrows():
-                judges = []
-                for i in range(1, 6):
-                    judge = row.get(f'Judge {i}')
-                    if pd.notna(judge):
-                        judges.append(judge)
-
-                if len(judges) >= 2:
-                    for combo in combinations(sorted(judges), 2):
-                        panels.append(combo)
 
-            panel_counts = pd.Series(panels).value_counts()
+            # Every sorted judge pair per panel, counted in one vectorized pass
+            panel_counts = judge_pair_counts(csv_path, df)
             panel_counts = panel_counts[panel_counts >= min_occ]
 
             results = []
@@ -1007,41 +1221,44 @@ def execute_analyze_csa_data(analysis_type, filters={}, limit=100):
             min_contests = filters.get('min_occurrences', 10)
 
             # Get dancer's contests
-            dancer_df = df[(df['Male Name'] == dancer_name) | (df['Female Name'] == dancer_name)]
+            dancer_df = participant_rows(csv_path, df, dancer_name)
 
             if len(dancer_df) == 0:
                 return {"error": f"No records found for {dancer_name}"}
 
             # Calculate overall win rate
-            overall_wins = len(dancer_df[dancer_df['Placement'] == 1])
+            overall_wins = count_row_wins(csv_path, dancer_df)
             overall_rate = (overall_wins / len(dancer_df) * 100) if len(dancer_df) > 0 else 0
 
-            # Analyze each judge
-            judge_stats = {}
-            for judge_col in ['Judge 1', 'Judge 2', 'Judge 3', 'Judge 4', 'Judge 5']:
-                for judge in df[judge_col].dropna().unique():
-                    with_judge = dancer_df[
-                        (dancer_df['Judge 1'] == judge) |
-                        (dancer_df['Judge 2'] == judge) |
-                        (dancer_df['Judge 3'] == judge) |
-                        (dancer_df['Judge 4'] == judge) |
-                        (dancer_df['Judge 5'] == judge)
-                    ]
-
-                    if len(with_judge) >= min_contests:
-                        wins = len(with_judge[with_judge['Placement'] == 1])
-                        win_rate = (wins / len(with_judge) * 100)
-
-                        if judge not in judge_stats:
-                            judge_stats[judge] = {
-                                "judge": judge,
-                                "contests": int(len(with_judge)),
-                                "wins": int(wins),
-                                "win_rate_pct": round(win_rate, 1),
-                                "vs_overall": round(win_rate - overall_rate, 1)
-                            }
+            # Contests and wins per judge in one pass over the dancer's (row, judge) pairs
+            path, mtime = str(csv_path), csv_path.stat().st_mtime
+            codes, judge_names, missing = _stacked_codes(path, mtime, JUDGE_COLUMNS)
+            dancer_positions = dancer_df.index.to_numpy()
+            dancer_codes = codes[:, dancer_positions]
+            rows = np.broadcast_to(np.arange(len(dancer_positions)), dancer_codes.shape)
+            listed = ~missing[dancer_codes]
+            # A judge listed twice on one panel still counts that contest once
+            pair_keys = np.unique(rows[listed] * len(judge_names) + dancer_codes[listed])
+            pair_rows, pair_judges = np.divmod(pair_keys, len(judge_names))
+            judge_contests = np.bincount(pair_judges, minlength=len(judge_names))
+            judge_wins = np.bincount(pair_judges, weights=_win_flags(path, mtime)[dancer_positions][pair_rows], minlength=len(judge_names))
+
+            # Judges in the order they first appear in the filtered archive, column by column
+            judge_stats = []
+            for code in pd.unique(codes[:, df.index.to_numpy()].ravel()):
+                if missing[code] or judge_contests[code] < min_contests or judge_contests[code] == 0:
+                    continue
+                contests, wins = int(judge_contests[code]), int(judge_wins[code])
+                win_rate = (wins / contests * 100)
+                judge_stats.append({
+                    "judge": judge_names[code],
+                    "contests": contests,
+                    "wins": wins,
+                    "win_rate_pct": round(win_rate, 1),
+                    "vs_overall": round(win_rate - overall_rate, 1)
+                })
 
-            results = sorted(judge_stats.values(), key=lambda x: x['win_rate_pct'], reverse=True)
+            results = sorted(judge_stats, key=lambda x: x['win_rate_pct'], reverse=True)
 
             return {
                 "analysis": f"Judge-specific outcomes for {dancer_name}",
@@ -1054,61 +1271,29 @@ def execute_analyze_csa_data(analysis_type, filters={}, limit=100):
             }
 
         elif analysis_type == "retention_analysis":
-            # Find Amateur dancers
-            amateur_dancers = set(
-                df[df['Division'] == 'Amateur']['Male Name'].dropna().unique().tolist() +
-                df[df['Division'] == 'Amateur']['Female Name'].dropna().unique().tolist()
-            )
-
-            # Find Pro dancers
-            pro_dancers = set(
-                df[df['Division'] == 'Pro']['Male Name'].dropna().unique().tolist() +
-                df[df['Division'] == 'Pro']['Female Name'].dropna().unique().tolist()
-            )
+            # Find Amateur and Pro dancers in one pass
+            dancers = division_dancers(df, ['Amateur', 'Pro'])
+            amateur_dancers, pro_dancers = dancers['Amateur'], dancers['Pro']
 
-            made_it_to_pro = amateur_dancers.intersection(pro_dancers)
+            made_it_to_pro = np.intersect1d(amateur_dancers, pro_dancers, assume_unique=True)
 
             return {
                 "analysis": "Amateur to Pro retention",
                 "total_amateur_dancers": len(amateur_dancers),
                 "reached_pro": len(made_it_to_pro),
-                "retention_rate_pct": round(len(made_it_to_pro) / len(amateur_dancers) * 100, 1) if amateur_dancers else 0,
+                "retention_rate_pct": round(len(made_it_to_pro) / len(amateur_dancers) * 100, 1) if len(amateur_dancers) else 0,
                 "still_amateur_only": len(amateur_dancers) - len(made_it_to_pro)
             }
 
         elif analysis_type == "career_progression_time":
-            # Calculate average time from Amateur to Pro
-            amateur_dancers = set(
-                df[df['Division'] == 'Amateur']['Male Name'].dropna().unique().tolist() +
-                df[df['Division'] == 'Amateur']['Female Name'].dropna().unique().tolist()
-            )
-
-            pro_dancers = set(
-                df[df['Division'] == 'Pro']['Male Name'].dropna().unique().tolist() +
-                df[df['Division'] == 'Pro']['Female Name'].dropna().unique().tolist()
-            )
-
-            made_it = amateur_dancers.intersection(pro_dancers)
-            progression_times = []
-
-            for dancer in made_it:
-                amateur_years = df[
-                    ((df['Male Name'] == dancer) | (df['Female Name'] == dancer)) &
-                    (df['Division'] == 'Amateur')
-                ]['Year']
-
-                pro_years = df[
-                    ((df['Male Name'] == dancer) | (df['Female Name'] == dancer)) &
-                    (df['Division'] == 'Pro')
-                ]['Year']
-
-                if len(amateur_years) > 0 and len(pro_years) > 0:
-                    first_amateur = int(amateur_years.min())
-                    first_pro = int(pro_years.min())
-                    years_to_pro = first_pro - first_amateur
-
-                    if years_to_pro > 0:
-                        progression_times.append(years_to_pro)
+            # Calculate average time from Amateur to Pro: each dancer's first year in both divisions at once
+            first_years = division_people(df, ['Amateur', 'Pro']).groupby(['name', 'Division'], sort=False)['Year'].min().unstack('Division')
+            if 'Amateur' in first_years and 'Pro' in first_years:
+                # Dancers missing either division come out NaN and fail the > 0 test
+                years_to_pro = first_years['Pro'] - first_years['Amateur']
+                progression_times = years_to_pro[years_to_pro > 0].astype(int).tolist()
+            else:
+                progression_times = []
 
             return {
                 "analysis": "Time to progress from Amateur to Pro",
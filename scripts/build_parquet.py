@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Parquet Snapshot Script for Ask Shaggy Archive
+Write a typed, columnar copy of the archive CSV for fast startup loads
+"""
+
+import hashlib
+import pandas as pd
+import sys
+from pathlib import Path
+
+# Low-cardinality text columns stored as categoricals
+CATEGORY_COLUMNS = ['Contest', 'Organization', 'Host Club', 'Division', 'Couple Name']
+
+def build_parquet():
+    """Convert the archive CSV to data/Shaggy_Shag_Archives_Final.parquet"""
+
+    # Paths
+    current_dir = Path(__file__).parent.parent
+    data_dir = current_dir / "data"
+    csv_path = data_dir / "Shaggy_Shag_Archives_Final.csv"
+    parquet_path = data_dir / "Shaggy_Shag_Archives_Final.parquet"
+
+    try:
+        print(f"📊 Loading archive from: {csv_path}")
+        df = pd.read_csv(csv_path)
+        print(f"✅ Loaded {len(df)} records")
+
+        df = df.astype({col: 'category' for col in CATEGORY_COLUMNS if col in df.columns})
+        df['Year'] = df['Year'].astype('int16')
+        df['Placement'] = df['Placement'].astype('int16')
+
+        # The app only uses the snapshot while this still matches the CSV
+        df.attrs['source_csv_sha256'] = hashlib.sha256(csv_path.read_bytes()).hexdigest()
+
+        df.to_parquet(parquet_path, compression='zstd', index=False)
+        print(f"✅ Parquet snapshot saved: {parquet_path} ({parquet_path.stat().st_size} bytes)")
+        print("ℹ️ The app falls back to the CSV once it changes - rerun after every data update")
+        return True
+
+    except Exception as e:
+        print(f"❌ ERROR: {e}")
+        return False
+
+if __name__ == "__main__":
+    success = build_parquet()
+    sys.exit(0 if success else 1)
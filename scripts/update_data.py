@@ -7,6 +7,17 @@ Safely merge new contest data with existing records
 import pandas as pd
 import sys
 from pathlib import Path
+from build_parquet import build_parquet
+
+# New data is read this many rows at a time so it never sits in memory alongside the whole archive
+NEW_DATA_CHUNK_ROWS = 50_000
+
+def _merge_latest(kept, chunk):
+    """Rows of kept and chunk with one row per Archive ID, chunk's rows replacing earlier ones"""
+    if kept is None:
+        return chunk
+    merged = pd.concat([kept, chunk])
+    return merged[~merged.index.duplicated(keep='last')]
 
 def update_archive_data(new_data_file, backup=True):
     """
@@ -29,19 +40,15 @@ def update_archive_data(new_data_file, backup=True):
         existing_df = pd.read_csv(original_file)
         print(f"✅ Loaded {len(existing_df)} existing records")
         
-        # Load new data
-        print(f"📥 Loading new data from: {new_data_file}")
-        new_df = pd.read_csv(new_data_file)
-        print(f"✅ Loaded {len(new_df)} new records")
-        
-        # Validate columns match
+        # Validate columns match (header only - the rows are streamed below)
         required_columns = [
             'Archive ID', 'Contest', 'Organization', 'Year', 'Host Club',
             'Placement', 'Division', 'Female Name', 'Male Name', 'Couple Name',
             'Judge 1', 'Judge 2', 'Judge 3', 'Judge 4', 'Judge 5', 'Record ID'
         ]
         
-        missing_cols = set(required_columns) - set(new_df.columns)
+        new_columns = pd.read_csv(new_data_file, nrows=0).columns
+        missing_cols = set(required_columns) - set(new_columns)
         if missing_cols:
             print(f"❌ ERROR: Missing required columns in new data: {missing_cols}")
             return False
@@ -55,18 +62,21 @@ def update_archive_data(new_data_file, backup=True):
         
         # Merge strategy: Update existing records, add new ones
         # Use 'Archive ID' as the key for updates
-        
-        # Remove duplicates from new data based on Archive ID
-        new_df_clean = new_df.drop_duplicates(subset=['Archive ID'], keep='last')
-        
-        # Update existing records
         updated_df = existing_df.set_index('Archive ID')
-        new_df_indexed = new_df_clean.set_index('Archive ID')
         
-        # Find records to update vs add
-        update_mask = new_df_indexed.index.isin(updated_df.index)
-        records_to_update = new_df_indexed[update_mask]
-        records_to_add = new_df_indexed[~update_mask]
+        # Stream the new data, splitting each chunk into updates vs additions. Duplicates are
+        # resolved as each chunk arrives (the last occurrence wins), so only one row per Archive ID
+        # is ever held - never the whole new file
+        print(f"📥 Loading new data from: {new_data_file}")
+        new_count = 0
+        records_to_update = records_to_add = None
+        for chunk in pd.read_csv(new_data_file, chunksize=NEW_DATA_CHUNK_ROWS):
+            new_count += len(chunk)
+            chunk = chunk.drop_duplicates(subset=['Archive ID'], keep='last').set_index('Archive ID')
+            update_mask = chunk.index.isin(updated_df.index)
+            records_to_update = _merge_latest(records_to_update, chunk[update_mask])
+            records_to_add = _merge_latest(records_to_add, chunk[~update_mask])
+        print(f"✅ Loaded {new_count} new records")
         
         print(f"🔄 Records to update: {len(records_to_update)}")
         print(f"➕ Records to add: {len(records_to_add)}")
@@ -84,18 +94,21 @@ def update_archive_data(new_data_file, backup=True):
         final_df.to_csv(original_file, index=False)
         print(f"✅ Updated archive saved: {len(final_df)} total records")
         
+        # Refresh the Parquet snapshot so the app doesn't fall back to the CSV
+        build_parquet()
+        
         # Summary
         print(f"""
 📊 UPDATE SUMMARY:
 - Original records: {len(existing_df)}
-- New file records: {len(new_df)}
+- New file records: {new_count}
 - Records updated: {len(records_to_update)}
 - Records added: {len(records_to_add)}
 - Final total: {len(final_df)}
 - Backup: {backup_file.name if backup else 'None'}
 
 🚀 Ready to deploy! Run:
-   git add data/Shaggy_Shag_Archives_Final.csv
+   git add data/Shaggy_Shag_Archives_Final.csv data/Shaggy_Shag_Archives_Final.parquet
    git commit -m "📊 Data update: +{len(records_to_add)} new, ~{len(records_to_update)} updated"
    git push origin main
         """)